@@ -1,15 +1,76 @@
 """RESTful API for the iFlask application."""
 
-from flask import Flask, request
+from flask import Flask, Response, request, g
 from flask_restful import Resource, Api
-from datetime import datetime
-from iFlask_app.model import Model
-import requests
+from datetime import datetime, timezone, timedelta
+from iFlask_app.model import (Model, CHECKED_IN, NOT_FOUND, NO_DAYS_LEFT,
+                              COMMIT_LAG)
+from iFlask_app.device_client import DeviceClient, DeviceUnavailable
+from iFlask_app.jobs import JobQueue, JobQueueFull
+from iFlask_app.events import EventBus, CHECKIN, ENROLL, DELETE
 
 app = Flask(__name__)
 api = Api(app)
 
-ESP32_IP = "192.168.43.63"
+# Created once at startup: reads the configuration and prepares the
+# database, so requests only pay for their own session.
+model = Model()
+model.session.close()
+
+# Shared, pooled connection to the fingerprint scanner
+device = DeviceClient.from_config(model.config)
+
+# Largest number of events accepted by one POST /api/checkins
+MAX_CHECKIN_BATCH = 1000
+
+# Enrollments wait for finger presses on the scanner, so they run as
+# background jobs instead of holding the request open.
+jobs = JobQueue(
+    max_workers=int(model.config.get_value('Jobs', 'max_workers')),
+    max_pending=int(model.config.get_value('Jobs', 'max_pending')))
+
+# Check-ins, enrollments and deletions, streamed to the GUI
+event_bus = EventBus()
+
+
+def get_model():
+    """Return the request-scoped model, opening its session on first use."""
+    if 'model' not in g:
+        g.model = model.bind(model.Session())
+    return g.model
+
+
+def enroll_on_device(user_id):
+    """Enroll a user's fingerprint on the ESP32; runs as a job."""
+    payload = {"user_id": user_id, "operation": "enroll"}
+    response = device.get('/enroll_user', params=payload)
+    if response.status_code != 200:
+        raise RuntimeError('Failed to enroll user.')
+    event_bus.publish(ENROLL, user_id=user_id)
+    return {'message': 'User enrolled successfully.'}
+
+
+def parse_timestamp(value):
+    """Parse an ISO 8601 timestamp into a naive UTC datetime."""
+    timestamp = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def user_to_dict(user):
+    """Return a JSON serializable view of a UserRow."""
+    return {field: (value.isoformat()
+                    if isinstance(value, datetime) else value)
+            for field, value in user._asdict().items()}
+
+
+@app.teardown_appcontext
+def close_session(exception=None):
+    """Close the request-scoped session at the end of the request."""
+    request_model = g.pop('model', None)
+    if request_model is not None:
+        request_model.session.close()
 
 
 class UserController(Resource):
@@ -17,9 +78,10 @@ class UserController(Resource):
     which exposes the /api/user endpoint, and a bridge
     between the esp32 and iFlask controller class."""
 
-    def __init__(self):
-        """Initialize the UserController class."""
-        self.model = Model()
+    @property
+    def model(self):
+        """The model bound to the current request's session."""
+        return get_model()
 
     def get(self):
         """GET request handler for the /api/user endpoint."""
@@ -32,27 +94,31 @@ class UserController(Resource):
         operation = data['operation']
 
         if operation == "enroll":
-            url = f"http://{ESP32_IP}/enroll_user"
-            payload = {"user_id": user_id, "operation": operation}
-            response = requests.get(url, params=payload)
-
-            if response.status_code == 200:
-                return {'message': 'User enrolled successfully.'}, 200
-            else:
-                return {'message': 'Failed to enroll user.'}, 500
+            if device.is_open:
+                return {'message': 'Fingerprint scanner unavailable.'}, 503
+            try:
+                job = jobs.submit('enroll', enroll_on_device, user_id=user_id)
+            except JobQueueFull:
+                return {'message': 'Too many enrollments in progress.'}, 503
+            return job.to_dict(), 202, {'Location': f'/api/jobs/{job.id}'}
         elif operation == 'checkin':
-
-            checkedin_user = self.model.get_user_by_id(user_id)
-            if checkedin_user:
-                now = datetime.utcnow()
-                if ((checkedin_user.last_check_in
-                     ).date()) != now.date():
-                    checkedin_user = self.model.get_user_update(
-                        checkedin_user.id)
-                return {'user_id': str(user_id),
-                        'first_name': str(checkedin_user.first_name)}, 200
-            else:
+            status, checkedin_user = self.model.check_in(
+                user_id, device_id=data.get('device_id'))
+            if status == NOT_FOUND:
                 return {'message': 'User not found.'}, 404
+
+            response = {'user_id': str(user_id),
+                        'first_name': str(checkedin_user.first_name),
+                        'remaining_days': checkedin_user.remaining_days,
+                        'status': status}
+            if status == NO_DAYS_LEFT:
+                response['message'] = 'No remaining days.'
+                return response, 403
+            if status == CHECKED_IN:
+                event_bus.publish(
+                    CHECKIN, user_id=user_id,
+                    remaining_days=checkedin_user.remaining_days)
+            return response, 200
         else:
             return {'message': 'Invalid operation.'}, 400
 
@@ -65,13 +131,16 @@ class UserController(Resource):
 
         if operation == "delete":
             # Send the delete request to ESP32
-            url = f"http://{ESP32_IP}/delete_user"
             payload = {"user_id": user_id,
                        "operation": operation,
                        "first_name": first_name}
-            response = requests.get(url, params=payload)
+            try:
+                response = device.get('/delete_user', params=payload)
+            except DeviceUnavailable:
+                return {'message': 'Fingerprint scanner unavailable.'}, 503
 
             if response.status_code == 200:
+                event_bus.publish(DELETE, user_id=user_id)
                 return {'message': 'User deleted successfully.'}, 200
             else:
                 return {'message': 'Failed to delete user.'}, 500
@@ -79,7 +148,149 @@ class UserController(Resource):
             return {'message': 'Invalid operation.'}, 400
 
 
+class UsersController(Resource):
+    """Exposes the /api/users endpoint, which lets clients keep a copy
+    of the members in sync by polling for what changed."""
+
+    def get(self):
+        """GET request handler for the /api/users endpoint.
+
+        Returns the users added or updated after the optional 'since'
+        timestamp (all users without it), the ids of the users deleted
+        after it, and a watermark to pass as 'since' on the next poll.
+        The watermark stays COMMIT_LAG behind now, so changes still
+        committing are not skipped; the newest rows may come again."""
+        since = None
+        if 'since' in request.args:
+            try:
+                since = parse_timestamp(request.args['since'])
+            except ValueError:
+                return {'message': 'Invalid timestamp.'}, 400
+
+        request_model = get_model()
+        users = request_model.get_users_changed_since(since)
+        deleted = (request_model.get_users_deleted_since(since)
+                   if since is not None else [])
+        # Both lists are in time order, so their last rows are the newest
+        seen = [user.updated_at for user in users[-1:]] + \
+            [row.deleted_at for row in deleted[-1:]]
+        watermark = since
+        if seen:
+            watermark = min(max(seen), datetime.utcnow() - COMMIT_LAG)
+            if since is not None:
+                watermark = max(watermark, since)
+        return {'users': [user_to_dict(user) for user in users],
+                'deleted': [row.user_id for row in deleted],
+                'watermark': watermark.isoformat() if watermark else None}, 200
+
+
+class JobController(Resource):
+    """Exposes the /api/jobs/<job_id> endpoint for polling
+    background jobs such as enrollments."""
+
+    def get(self, job_id):
+        """GET request handler for the /api/jobs/<job_id> endpoint."""
+        job = jobs.get(job_id)
+        if job is None:
+            return {'message': 'Job not found.'}, 404
+        return job.to_dict(), 200
+
+
+class CheckinsController(Resource):
+    """Exposes the /api/checkins endpoint, which lets a scanner flush
+    the check-ins it buffered while offline in a single request."""
+
+    def post(self):
+        """POST request handler for the /api/checkins endpoint.
+
+        Accepts a list of {user_id, scanned_at, device_id} events, or an
+        object holding that list under 'events', and returns one result
+        per event in the same order."""
+        data = request.get_json()
+        if isinstance(data, dict):
+            data = data.get('events')
+        if not isinstance(data, list):
+            return {'message': 'Expected a list of events.'}, 400
+        if len(data) > MAX_CHECKIN_BATCH:
+            return {'message': f'At most {MAX_CHECKIN_BATCH} events '
+                               'per request.'}, 413
+
+        results = []
+        events = []
+        for item in data:
+            result = {'user_id': None, 'device_id': None,
+                      'scanned_at': None, 'status': 'invalid'}
+            results.append(result)
+            try:
+                result['user_id'] = int(item['user_id'])
+                result['device_id'] = item.get('device_id')
+                scanned_at = parse_timestamp(item['scanned_at'])
+                result['scanned_at'] = scanned_at.isoformat()
+            except (KeyError, TypeError, ValueError, AttributeError):
+                result['message'] = 'Invalid event.'
+                continue
+            events.append((result, {'user_id': result['user_id'],
+                                    'scanned_at': scanned_at,
+                                    'device_id': result['device_id']}))
+
+        applied = get_model().check_in_many(
+            [event for _, event in events]) if events else []
+        for (result, _), (status, row) in zip(events, applied):
+            result['status'] = status
+            if row is not None:
+                result['first_name'] = row.first_name
+                result['remaining_days'] = row.remaining_days
+            if status == CHECKED_IN:
+                event_bus.publish(CHECKIN, user_id=result['user_id'],
+                                  remaining_days=row.remaining_days)
+        return {'results': results}, 200
+
+
+class EventsController(Resource):
+    """Exposes the /api/events endpoint, a text/event-stream of
+    check-in, enroll and delete events that keeps the GUI live."""
+
+    def get(self):
+        """GET request handler for the /api/events endpoint."""
+        return Response(event_bus.stream(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache',
+                                 'X-Accel-Buffering': 'no'})
+
+
+class AttendanceController(Resource):
+    """Exposes the /api/attendance endpoint, which serves check-in
+    counts from the attendance rollups."""
+
+    def get(self):
+        """GET request handler for the /api/attendance endpoint.
+
+        Optional query parameters: 'from' and 'to' dates (YYYY-MM-DD,
+        'to' exclusive, the last 30 days by default) and 'granularity'
+        ('day' or 'hour')."""
+        granularity = request.args.get('granularity', 'day')
+        if granularity not in ('day', 'hour'):
+            return {'message': 'Invalid granularity.'}, 400
+        try:
+            end = (datetime.fromisoformat(request.args['to']).date()
+                   if 'to' in request.args
+                   else datetime.utcnow().date() + timedelta(days=1))
+            start = (datetime.fromisoformat(request.args['from']).date()
+                     if 'from' in request.args
+                     else end - timedelta(days=30))
+        except ValueError:
+            return {'message': 'Invalid date.'}, 400
+
+        rows = get_model().get_attendance(start, end, granularity)
+        return {'attendance': [dict(row._mapping, day=row.day.isoformat())
+                               for row in rows]}, 200
+
+
 api.add_resource(UserController, '/api/user')
+api.add_resource(UsersController, '/api/users')
+api.add_resource(CheckinsController, '/api/checkins')
+api.add_resource(AttendanceController, '/api/attendance')
+api.add_resource(EventsController, '/api/events')
+api.add_resource(JobController, '/api/jobs/<string:job_id>')
 
 if __name__ == "__main__":
     """Run the iFlask Api server."""
@@ -0,0 +1,4 @@
+"""Benchmarks for the iFlask application.
+
+Run them from the project root, e.g. ``python -m benchmarks.bench_api_model``.
+"""
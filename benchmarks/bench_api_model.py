@@ -0,0 +1,52 @@
+"""Per-request cost of building a Model versus binding the app-scoped one.
+
+Before: every API request constructed ``Model()``, which re-read
+config.ini and ran the database set-up checks before the first query.
+After: the API builds one Model at startup and each request binds it to
+a fresh session that is closed in a teardown hook.
+"""
+
+import time
+
+from benchmarks.sandbox import sandbox
+
+REQUESTS = 2000
+
+
+def per_request(label, handle):
+    """Time ``handle`` over REQUESTS calls and print the mean cost."""
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        handle()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed / REQUESTS * 1e6:10.1f} us/request")
+
+
+def main():
+    """Run the benchmark."""
+    with sandbox():
+        from iFlask_app.model import Model
+
+        app_model = Model()
+        user_id = app_model.get_all_users()[0].id
+
+        def before():
+            # The old handler never closed this session; close it here
+            # so the run does not exhaust the connection pool.
+            request_model = Model()
+            request_model.get_user_by_id(user_id)
+            request_model.session.close()
+
+        def after():
+            session = app_model.Session()
+            try:
+                app_model.bind(session).get_user_by_id(user_id)
+            finally:
+                session.close()
+
+        per_request("before: Model() per request", before)
+        per_request("after: bound session", after)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Adding, updating and deleting members one at a time versus in bulk.
+
+The one-at-a-time paths commit, and so sync the database file, once
+per member, so they are timed on --single users and reported per
+member; the bulk methods are timed on a roster of --users members.
+
+    python -m benchmarks.bench_bulk_users [--users N] [--single N]
+"""
+
+import argparse
+import time
+
+from benchmarks.sandbox import sandbox
+
+
+def roster(first, count):
+    """Return count members with phone numbers starting after first."""
+    return [{'first_name': f'First{i}', 'last_name': f'Last{i}',
+             'email': f'user{i}@example.com', 'country_code': 1,
+             'phone_number': 3000000000 + i, 'gender': 'Female',
+             'membership_type': 'Member', 'remaining_days': 30}
+            for i in range(first, first + count)]
+
+
+def timed(label, count, run):
+    """Print the total and per-member time of run()."""
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {count:>8} {elapsed:9.3f} s "
+          f"{elapsed / count * 1e6:9.1f} us/user")
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--single', type=int, default=500)
+    args = parser.parse_args()
+
+    with sandbox(copy_database=False):
+        from iFlask_app.model import Model
+
+        model = Model()
+        single = roster(0, args.single)
+        timed('add_user', args.single,
+              lambda: [model.add_user(**user) for user in single])
+        users = [model.get_user_by_phone_number(user['phone_number'])
+                 for user in single]
+        timed('update_user', args.single,
+              lambda: [model.update_user(user, remaining_days=31)
+                       for user in users])
+        timed('delete_user', args.single,
+              lambda: [model.delete_user(user) for user in users])
+
+        bulk = roster(args.single, args.users)
+        timed('bulk_add_users', args.users,
+              lambda: model.bulk_add_users(bulk))
+        ids = [user.id for user in model.iter_users()
+               if user.phone_number > 3000000000 + args.single - 1]
+        timed('bulk_update_users', args.users,
+              lambda: model.bulk_update_users(
+                  {'id': user_id, 'remaining_days': 31}
+                  for user_id in ids))
+        timed('bulk_delete_users', args.users,
+              lambda: model.bulk_delete_users(ids))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Rows per second and peak memory of every export format.
+
+A fresh database is seeded with members, then each available format
+exports all of them from Model.iter_users in a process of its own, so
+the peak RSS of one format is not inflated by another. RSS is sampled
+with psutil while the export runs.
+
+    python -m benchmarks.bench_exporters [--users N]
+"""
+
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+
+import psutil
+
+from benchmarks.sandbox import sandbox, seed_users
+
+# Seconds between RSS samples
+SAMPLE_INTERVAL = 0.005
+
+
+def run_export(extension, results):
+    """Export every user in one format and report the rows per second,
+    baseline and peak RSS, and file size (child process)."""
+    from iFlask_app.model import Model
+    from iFlask_app.exporters import export
+
+    model = Model()
+    total = model.get_number_of_users()
+    process = psutil.Process()
+    baseline = peak = process.memory_info().rss
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not done.wait(SAMPLE_INTERVAL):
+            peak = max(peak, process.memory_info().rss)
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    file_path = f'users{extension}'
+    start = time.perf_counter()
+    export(file_path, model.iter_users(), total)
+    elapsed = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    peak = max(peak, process.memory_info().rss)
+    results.put((total / elapsed, baseline, peak,
+                 os.path.getsize(file_path)))
+
+
+def main():
+    """Run the benchmark for every available format."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200000)
+    args = parser.parse_args()
+
+    with sandbox(copy_database=False):
+        from iFlask_app.exporters import available_formats
+
+        seed_users('database.db', args.users)
+        # A fresh interpreter per format, so peaks are not inherited
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        print(f"{'format':<8} {'rows/s':>10} {'base MB':>8} "
+              f"{'peak MB':>8} {'file MB':>8}")
+        for _, extension in available_formats():
+            child = context.Process(target=run_export,
+                                    args=(extension, results))
+            child.start()
+            rate, baseline, peak, size = results.get()
+            child.join()
+            print(f"{extension:<8} {rate:10.0f} {baseline / 2 ** 20:8.1f} "
+                  f"{peak / 2 ** 20:8.1f} {size / 2 ** 20:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
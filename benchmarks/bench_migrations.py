@@ -0,0 +1,86 @@
+"""How long check-ins wait while migrations run on a large database.
+
+A database is seeded with members and years of check-ins but no
+rollups, no updated_at index and no search index, as one from before
+those features would be. The migrations then run on a thread while the
+main thread keeps checking members in, and the slowest check-ins are
+reported.
+
+    python -m benchmarks.bench_migrations [--users N] [--checkins N]
+"""
+
+import argparse
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.sandbox import sandbox, seed_users
+
+# Seconds between check-ins while the migrations run
+CHECK_IN_INTERVAL = 0.005
+HISTORY_DAYS = 3 * 365
+
+
+def seed_history(path, users, checkins):
+    """Add checkins spread over HISTORY_DAYS and leave the database as
+    it was before migration 2."""
+    start = datetime.utcnow() - timedelta(days=HISTORY_DAYS)
+    seconds = HISTORY_DAYS * 86400
+    generator = random.Random(0)
+    with sqlite3.connect(path) as connection:
+        connection.executemany(
+            "INSERT OR IGNORE INTO checkins (user_id, ts) VALUES (?, ?)",
+            ((generator.randint(1, users),
+              str(start + timedelta(seconds=generator.randrange(seconds))))
+             for _ in range(checkins)))
+        connection.execute("DROP INDEX ix_users_updated_at")
+        for name in ('insert', 'delete', 'update'):
+            connection.execute(f"DROP TRIGGER users_fts_{name}")
+        connection.execute("DROP TABLE users_fts")
+        connection.execute("DELETE FROM attendance_rollups")
+        connection.execute("DELETE FROM schema_version WHERE version > 1")
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--checkins', type=int, default=2000000)
+    args = parser.parse_args()
+
+    with sandbox(copy_database=False):
+        seed_users('database.db', args.users)
+        from iFlask_app.migrations import Migrator
+        from iFlask_app.model import Model
+        from iFlask_app.user_model import engine
+
+        model = Model()
+        seed_history('database.db', args.users, args.checkins)
+
+        migrator = threading.Thread(target=Migrator(engine, print).run)
+        start = time.perf_counter()
+        migrator.start()
+        latencies = []
+        user_id = 1
+        # Members are seeded as checked in today
+        tomorrow = datetime.utcnow() + timedelta(days=1)
+        while migrator.is_alive():
+            began = time.perf_counter()
+            model.check_in(user_id, now=tomorrow)
+            latencies.append(time.perf_counter() - began)
+            user_id += 1
+            time.sleep(CHECK_IN_INTERVAL)
+        migrator.join()
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        print(f"migrations: {elapsed:.2f} s, {len(latencies)} check-ins")
+        print(f"check-in median {latencies[len(latencies) // 2] * 1e3:.1f} "
+              f"ms, p99 {latencies[int(len(latencies) * 0.99)] * 1e3:.1f} "
+              f"ms, max {latencies[-1] * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
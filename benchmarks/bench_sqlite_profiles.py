@@ -0,0 +1,120 @@
+"""Check-in throughput under each SQLite profile while a report runs.
+
+For every [SQLite:<name>] profile in settings/config.ini, a fresh
+database is seeded with members. A separate process then keeps scanning
+the whole users table, the way the GUI does while generating a report,
+and writer threads perform check-ins through Model.check_in for a fixed
+time. The API and the GUI are separate processes, so the reader gets a
+process of its own.
+
+    python -m benchmarks.bench_sqlite_profiles [--users N] [--seconds S]
+        [--writers W]
+"""
+
+from datetime import datetime, timedelta
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+
+from benchmarks.sandbox import sandbox, seed_users
+
+
+def run_report(path, profile, stop, scans):
+    """Scan the users table repeatedly until stopped (reader process)."""
+    from iFlask_app.user_model import apply_sqlite_profile
+
+    connection = sqlite3.connect(path)
+    apply_sqlite_profile(connection, profile)
+    while not stop.is_set():
+        for _ in connection.execute("SELECT * FROM users"):
+            pass
+        with scans.get_lock():
+            scans.value += 1
+    connection.close()
+
+
+def run_checkins(base_model, session_factory, users, seconds, writer,
+                 counts, errors):
+    """Check members in until the time is up (writer thread)."""
+    session = session_factory()
+    model = base_model.bind(session)
+    day = datetime.utcnow()
+    user_id = writer
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        # Move a day forward on every pass over the members so each
+        # check-in passes the once-per-day rule.
+        user_id += 1
+        if user_id > users:
+            user_id = 1
+            day += timedelta(days=1)
+        try:
+            model.check_in(user_id, now=day)
+            counts[writer] += 1
+        except Exception:
+            session.rollback()
+            errors[writer] += 1
+    session.close()
+
+
+def benchmark(base_model, name, profile, users, seconds, writers):
+    """Run one profile and print its results."""
+    from sqlalchemy.orm import sessionmaker
+    from iFlask_app.user_model import make_engine
+
+    path = os.path.abspath(f'bench-{name}.db')
+    seed_users(path, users)
+    engine = make_engine(f'sqlite:///{path}', profile)
+    session_factory = sessionmaker(bind=engine)
+
+    stop = multiprocessing.Event()
+    scans = multiprocessing.Value('i', 0)
+    reader = multiprocessing.Process(
+        target=run_report, args=(path, profile, stop, scans))
+    reader.start()
+
+    counts = [0] * writers
+    errors = [0] * writers
+    threads = [threading.Thread(
+        target=run_checkins,
+        args=(base_model, session_factory, users, seconds, writer,
+              counts, errors))
+        for writer in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stop.set()
+    reader.join()
+    engine.dispose()
+
+    print(f"{name:<10} {sum(counts) / seconds:10.1f} check-ins/s "
+          f"{sum(errors):6d} errors {scans.value:6d} report scans")
+
+
+def main():
+    """Run the benchmark for every configured profile."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--writers', type=int, default=2)
+    args = parser.parse_args()
+
+    with sandbox(copy_database=False):
+        from iFlask_app.model import Model
+        from iFlask_app.user_model import get_sqlite_profile
+
+        base_model = Model()
+        config = base_model.config
+        for section in config.config.sections():
+            if section.startswith('SQLite:'):
+                name = section.split(':', 1)[1]
+                benchmark(base_model, name, get_sqlite_profile(config, name),
+                          args.users, args.seconds, args.writers)
+
+
+if __name__ == "__main__":
+    main()
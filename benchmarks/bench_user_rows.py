@@ -0,0 +1,97 @@
+"""Memory and latency of loading users as ORM objects or as UserRows.
+
+For every size a fresh database is seeded, then each path loads all of
+its users, and a page of them by id as the treeview does, in a process
+of its own so one path does not inherit the heap of the other. The
+memory column is the RSS still held while the users are referenced.
+
+    python -m benchmarks.bench_user_rows [--sizes 10000,100000,1000000]
+"""
+
+import argparse
+import multiprocessing
+import time
+
+import psutil
+
+from benchmarks.sandbox import sandbox, seed_users
+
+# Users per page, as fetched by the treeview
+PAGE_SIZE = 100
+PAGE_REPEATS = 200
+
+
+def load_orm(model, user_ids=None):
+    """Load users as ORM objects, the way the read paths used to."""
+    from sqlalchemy import select
+    from iFlask_app.user_model import User
+
+    if user_ids is None:
+        return model.get_all_users()
+    return model.session.scalars(
+        select(User).where(User.id.in_(user_ids))
+        .execution_options(populate_existing=True)).all()
+
+
+def load_rows(model, user_ids=None):
+    """Load users as UserRows from column-only selects."""
+    if user_ids is None:
+        return model.get_users_changed_since()
+    return model.get_users_by_ids(user_ids)
+
+
+PATHS = {'orm': load_orm, 'rows': load_rows}
+
+
+def run_path(name, results):
+    """Load every user, then pages of users, and report the seconds
+    taken and RSS retained (child process)."""
+    from iFlask_app.model import Model
+
+    load = PATHS[name]
+    model = Model()
+    total = model.get_number_of_users()
+    process = psutil.Process()
+    baseline = process.memory_info().rss
+    start = time.perf_counter()
+    users = load(model)
+    elapsed = time.perf_counter() - start
+    retained = process.memory_info().rss - baseline
+    assert len(users) == total
+    del users
+    model.session.expunge_all()
+
+    page = list(range(1, min(total, PAGE_SIZE) + 1))
+    start = time.perf_counter()
+    for _ in range(PAGE_REPEATS):
+        load(model, page)
+    page_elapsed = (time.perf_counter() - start) / PAGE_REPEATS
+    results.put((elapsed, retained, page_elapsed))
+
+
+def main():
+    """Run the benchmark for every size and path."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    args = parser.parse_args()
+
+    # A fresh interpreter per path, so memory is not inherited
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    print(f"{'users':>8} {'path':<5} {'load s':>8} {'bytes/user':>10} "
+          f"{'page ms':>8}")
+    for size in map(int, args.sizes.split(',')):
+        with sandbox(copy_database=False):
+            seed_users('database.db', size)
+            for name in PATHS:
+                child = context.Process(target=run_path,
+                                        args=(name, results))
+                child.start()
+                elapsed, retained, page_elapsed = results.get()
+                child.join()
+                print(f"{size:>8} {name:<5} {elapsed:8.3f} "
+                      f"{retained / size:10.0f} {page_elapsed * 1000:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Helpers for running benchmarks against a throwaway copy of the app."""
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@contextmanager
+def sandbox(copy_database=True):
+    """Run the body in a temporary directory holding a copy of the
+    settings (and optionally the database), so benchmarks never touch
+    the real database.db or config.ini."""
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='iflask-bench-') as workdir:
+        shutil.copytree(os.path.join(ROOT, 'settings'),
+                        os.path.join(workdir, 'settings'))
+        if copy_database:
+            shutil.copy(os.path.join(ROOT, 'database.db'), workdir)
+        os.chdir(workdir)
+        try:
+            yield workdir
+        finally:
+            os.chdir(previous)
+
+
+def seed_users(path, users):
+    """Create the schema in the database at path and insert members
+    with plenty of days left."""
+    from iFlask_app.user_model import Base, make_engine
+
+    Base.metadata.create_all(make_engine(f'sqlite:///{path}'))
+    now = datetime.utcnow()
+    with sqlite3.connect(path) as connection:
+        connection.executemany(
+            "INSERT INTO users (id, first_name, last_name, email, "
+            "country_code, phone_number, gender, last_check_in, "
+            "membership_type, next_payment, remaining_days, created_at, "
+            "updated_at) VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ((i, f'First{i}', f'Last{i}', f'user{i}@example.com',
+              2000000000 + i, ('Male', 'Female')[i % 2], now,
+              ('Member', 'Not Member')[i % 2], now, 10 ** 9, now, now)
+             for i in range(1, users + 1)))
@@ -1,13 +1,45 @@
 """This module contains the Controller class."""
 
 from settings.configuration import Configuration
-from iFlask_app.model import Model
+from iFlask_app.model import Model, ENROLL, COMMIT_LAG
 from iFlask_app.view import View
-import phonenumbers
+from iFlask_app.events import DELETE
+from iFlask_app.event_client import EventStream
+from iFlask_app.outbox import OutboxDispatcher
+from iFlask_app.exporters import export, available_formats
+from iFlask_app.validation import validate_user_fields
+from iFlask_app import importer
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
 import requests
+import os
+import threading
+import xlsxwriter
 import re
 
 url = "http://192.168.43.192:5000/api/user"
+jobs_url = "http://192.168.43.192:5000/api/jobs"
+events_url = "http://192.168.43.192:5000/api/events"
+
+# One pooled keep-alive session for the calls the GUI makes to the API
+api_session = requests.Session()
+api_session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=2))
+# (connect, read) timeouts of those calls. A delete waits for the
+# scanner, so the read timeout outlasts the API's own device timeouts.
+API_TIMEOUT = (3.05, 35)
+
+# How often to ask the API whether an enrollment job has finished
+JOB_POLL_INTERVAL_MS = 1000
+# How often to look for queued device operations that are due
+OUTBOX_INTERVAL_MS = 2000
+# Number of days covered by the attendance sheets of the report
+REPORT_ATTENDANCE_DAYS = 30
+# Number of matches shown for a search
+SEARCH_PAGE_SIZE = 50
+# How often to look for users changed by other processes, such as
+# check-ins through the API
+USER_SYNC_INTERVAL_MS = 5000
 
 
 class Controller:
@@ -32,6 +64,45 @@ class Controller:
 
         self.config = Configuration('settings/config.ini')
 
+        # Live searches run here so typing never waits on the database
+        self.search_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='search')
+
+        # Calls to the API run here, one operation at a time, so the
+        # window never waits on the network
+        self.io_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='io')
+        self.io_token = None
+        self.io_future = None
+        self.io_on_cancel = None
+
+        # Enrollments and deletions are queued in the outbox and sent to
+        # the API from the I/O worker, so operators can keep registering
+        # members while the API or the scanner is unreachable
+        self.outbox = OutboxDispatcher(
+            api_session, url, jobs_url, API_TIMEOUT,
+            job_poll_interval=JOB_POLL_INTERVAL_MS / 1000)
+        self.outbox_busy = False
+        self.outbox_after_id = None
+
+        # Reports are written and rosters imported here, behind the
+        # progress indicator
+        self.report_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='report')
+
+        # Polls for changed users run here, one at a time
+        self.sync_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='sync')
+        self.sync_watermark = None
+        self.sync_after_id = None
+
+        # Live check-ins and deletions from the API. While connected the
+        # polling above is skipped, except for one catch-up sync after
+        # every (re)connect for changes made while disconnected.
+        self.event_stream = EventStream(events_url, self.on_user_event,
+                                        self.on_events_connected)
+        self.sync_catch_up = True
+
     def admin(self, option):
         """Handles administrative options, such as login, logout,
         and adding an admin user."""
@@ -95,8 +166,8 @@ class Controller:
         self.config.save_changes()
 
     def enroll_user(self, event=None):
-        """Adds a new user to the database and communicates
-        with the Flask API for enrollment."""
+        """Adds a new user to the database and queues their
+        enrollment on the device."""
 
         user_inputs = self.view.get_user_entry_fields()
         is_valid = self.validate_user_inputs(**user_inputs)
@@ -107,28 +178,15 @@ class Controller:
         # Clear entry fields
         self.view.clear_entry_fields()
 
-        # Add user to database and return the user object
-        new_user = self.model.add_user(**user_inputs)
-
-        payload = {"user_id": new_user.id, "operation": "enroll"}
-        response = requests.post(url, json=payload)
-
-        if response.status_code == 200:
-            # Add user to treeview
-            self.view.add_user_to_treeview(new_user, update=False)
-            # Display message to user
-            self.view.display_message(
-                "User enrolled successfully", new_user.id)
-        else:
-            # delete from database
-            self.model.delete_user(new_user)
-            # Display error message
-            self.view.display_message(
-                "Failed to enroll user", new_user.id)
+        # Add user and their enrollment to the database in one commit
+        new_user = self.model.add_pending_user(**user_inputs)
+        self.view.set_pending_users(self.model.get_pending_enrollments())
+        self.view.add_user_to_treeview(new_user, update=False)
+        self.dispatch_outbox_now()
 
     def delete_user(self, event=None):
-        """Deletes a user from the database and communicates
-        with the Flask API for deletion."""
+        """Deletes a user from the database and queues their
+        deletion on the device."""
 
         current_user = self.config.get_value('User', 'current_user')
         if current_user != 'admin':
@@ -145,22 +203,157 @@ class Controller:
         # Clear entry fields
         self.view.clear_entry_fields()
 
-        # send delete post request to Flask API
-        payload = {"user_id": selected_user.id, "operation": "delete",
-                   "first_name": selected_user.first_name}
-        response = requests.delete(url, json=payload)
-
-        if response.status_code == 200:
-            # Delete user from database
-            self.model.delete_user(selected_user)
-            # Delete user from treeview
-            self.view.delete_user_from_treeview()
-            # Display message to user
+        user_id = selected_user.id
+        self.model.queue_user_deletion(selected_user)
+        self.view.apply_user_changes([], [user_id])
+        self.view.display_message("User deleted successfully", user_id)
+        self.dispatch_outbox_now()
+
+    def dispatch_outbox(self):
+        """Sends the queued device operations that are due on the I/O
+        worker thread, then shows the outcome."""
+        self.outbox_after_id = None
+        if self.outbox_busy:
+            # The running pass schedules the next one
+            return
+        self.outbox_busy = True
+        future = self.io_executor.submit(self.dispatch_outbox_in_worker)
+        future.add_done_callback(
+            lambda done: self.view.call_soon(self.finish_dispatch_outbox,
+                                             done))
+
+    def dispatch_outbox_now(self):
+        """Dispatches queued operations without waiting for the next
+        interval."""
+        if self.outbox_after_id is not None:
+            self.view.after_cancel(self.outbox_after_id)
+        self.dispatch_outbox()
+
+    def dispatch_outbox_in_worker(self):
+        """Runs a dispatcher pass and returns its outcome with the
+        enrollments still queued."""
+        with self.model.scoped() as model:
+            return (self.outbox.run_pass(model),
+                    model.get_pending_enrollments())
+
+    def finish_dispatch_outbox(self, future):
+        """Reconciles the treeview with the operations the API carried
+        out or refused, and schedules the next pass."""
+        self.outbox_busy = False
+        if future.exception() is None:
+            finished, pending = future.result()
+            self.view.set_pending_users(pending)
+            for operation, user_id, succeeded in finished:
+                if operation == ENROLL and succeeded:
+                    self.view.display_message(
+                        "User enrolled successfully", user_id)
+                elif operation == ENROLL:
+                    self.view.apply_user_changes([], [user_id])
+                    self.view.display_message(
+                        "Failed to enroll user", user_id)
+                elif not succeeded:
+                    self.view.display_message(
+                        "Failed to delete user from the scanner", user_id)
+        self.outbox_after_id = self.view.after(OUTBOX_INTERVAL_MS,
+                                               self.dispatch_outbox)
+
+    def import_users(self, event=None):
+        """Imports the members of a roster file on the report worker,
+        with a cancel button."""
+        current_user = self.config.get_value('User', 'current_user')
+        if current_user != 'admin':
             self.view.display_message(
-                "User deleted successfully", selected_user.id)
-        else:
+                "You are not authorized to perform this operation")
+            return
+        if self.io_token is not None:
             self.view.display_message(
-                "Failed to delete user", selected_user.id)
+                "Please wait for the current operation to finish")
+            return
+        file_path = self.view.ask_import_path(
+            available_formats(importer.READERS))
+        if not file_path:
+            return
+
+        cancelled = threading.Event()
+        token = self.start_io("Importing members...", cancelled.set)
+        self.submit_io(
+            token, self.report_executor, self.finish_import_users,
+            self.import_users_in_worker, token, file_path, cancelled)
+
+    def import_users_in_worker(self, token, file_path, cancelled):
+        """Imports the roster, reporting progress to the window."""
+        with self.model.scoped() as model:
+            return importer.import_users(
+                file_path, model,
+                progress=lambda fraction: self.view.call_soon(
+                    self.show_io_progress, token, fraction),
+                is_cancelled=cancelled.is_set)
+
+    def finish_import_users(self, future):
+        """Shows the imported members and tells the user how the
+        import went."""
+        self.end_io()
+        if isinstance(future.exception(), OSError):
+            self.view.display_message("Could not read the roster file")
+            return
+        elif isinstance(future.exception(), ValueError):
+            # An extension no reader handles, or undecodable text
+            self.view.display_message(str(future.exception()))
+            return
+        elif future.exception() is not None:
+            raise future.exception()
+
+        result = future.result()
+        self.view.refresh_treeview()
+        message = f"Imported {result.imported} members"
+        if result.rejected:
+            message += (f", rejected {result.rejected} listed in "
+                        f"{os.path.basename(result.reject_path)}")
+        self.view.display_info(message)
+
+    def start_io(self, text, on_cancel):
+        """Shows the progress indicator for a background operation and
+        returns its token. Cancelling the operation drops the
+        results still to come and runs on_cancel."""
+        token = object()
+        self.io_token = token
+        self.io_on_cancel = on_cancel
+
+        def cancel():
+            if self.io_token is token:
+                if self.io_future is not None:
+                    self.io_future.cancel()
+                self.end_io()
+                on_cancel()
+
+        self.view.show_progress(text, cancel)
+        return token
+
+    def submit_io(self, token, executor, on_done, func, *args, **kwargs):
+        """Runs func(*args, **kwargs) on a worker thread of the executor,
+        then on_done(future) on the Tk main loop unless the operation of
+        the token was cancelled in the meantime."""
+        future = executor.submit(func, *args, **kwargs)
+        self.io_future = future
+
+        def finish(done):
+            if self.io_token is token and not done.cancelled():
+                on_done(done)
+        future.add_done_callback(
+            lambda done: self.view.call_soon(finish, done))
+
+    def show_io_progress(self, token, fraction):
+        """Updates the progress bar unless the operation of the token
+        has ended."""
+        if self.io_token is token:
+            self.view.set_progress(fraction)
+
+    def end_io(self):
+        """Hides the progress indicator of the current operation."""
+        self.io_token = None
+        self.io_future = None
+        self.io_on_cancel = None
+        self.view.hide_progress()
 
     def update_user(self, event=None) -> None:
         """Updates a user's information in the database
@@ -219,10 +412,96 @@ class Controller:
         # No changes in the entry fields
         self.view.clear_entry_fields()
 
-    def generate_report(self, event=None):
-        """Generates a report of all the users in the database."""
-        all_users = self.model.get_all_users()
-        self.view.generate_report(all_users)
+    def generate_report(self, event=None, incremental=False):
+        """Generates a report of all the users in the database,
+        with attendance summary sheets read from the rollups.
+
+        An incremental report only holds the users added or updated
+        since the last report. The users are counted on the IO worker,
+        then the report is streamed from the database to the file on
+        the report worker thread, behind a progress bar with a cancel
+        button."""
+        if self.io_token is not None:
+            self.view.display_message(
+                "Please wait for the current operation to finish")
+            return
+        # Everything stamped before this has committed by the time the
+        # report reads the users
+        watermark = datetime.utcnow() - COMMIT_LAG
+        token = self.start_io("Counting users...", lambda: None)
+        self.submit_io(
+            token, self.io_executor,
+            lambda future: self.ask_report_path(future, watermark),
+            self.count_report_users_in_worker, incremental)
+
+    def count_report_users_in_worker(self, incremental):
+        """Returns the watermark of the last report, or None for a full
+        report, and the number of users the report will hold."""
+        with self.model.scoped() as model:
+            since = model.get_report_watermark() if incremental else None
+            if since is None:
+                return None, model.get_number_of_users()
+            return since, model.count_users_changed_since(since)
+
+    def ask_report_path(self, future, watermark):
+        """Asks where to write the counted users, then writes the report
+        on the report worker."""
+        self.end_io()
+        since, total = future.result()
+        if not total:
+            self.view.display_message(
+                "No users changed since the last report"
+                if since is not None else "You Have Empty Database")
+            return
+        file_path = self.view.ask_report_path(available_formats())
+        if not file_path:
+            return
+        if since is not None:
+            watermark = max(watermark, since)
+
+        cancelled = threading.Event()
+        token = self.start_io("Generating report...", cancelled.set)
+        self.submit_io(
+            token, self.report_executor, self.finish_generate_report,
+            self.generate_report_in_worker, token, file_path, total,
+            cancelled, since, watermark)
+
+    def generate_report_in_worker(self, token, file_path, total, cancelled,
+                                  since, watermark):
+        """Writes the report, then records its watermark and the number
+        of users written. Returns False if the report was cancelled."""
+        with self.model.scoped() as model:
+            end = datetime.utcnow().date() + timedelta(days=1)
+            start = end - timedelta(days=REPORT_ATTENDANCE_DAYS)
+            attendance = {
+                'Daily Attendance': model.get_attendance(start, end),
+                'Hourly Attendance': model.get_attendance(
+                    start, end, granularity='hour'),
+            }
+            written = export(
+                file_path, model.iter_users(since=since), total, attendance,
+                progress=lambda fraction: self.view.call_soon(
+                    self.show_io_progress, token, fraction),
+                is_cancelled=cancelled.is_set)
+            if written is None:
+                return False
+            model.record_report_export(since is not None, watermark,
+                                       written)
+            return True
+
+    def finish_generate_report(self, future):
+        """Tells the user how writing the report went."""
+        self.end_io()
+        if isinstance(future.exception(),
+                      (OSError, xlsxwriter.exceptions.FileCreateError)):
+            self.view.display_message("Could not write the report file")
+        elif isinstance(future.exception(), ValueError):
+            # An extension no exporter handles
+            self.view.display_message(str(future.exception()))
+        elif future.exception() is None:
+            self.view.display_info("Report Generated")
+        else:
+            raise future.exception()
 
     def validate_admin_inputs(self, option, **kwargs):
         """Validates the admin user input fields."""
@@ -267,61 +546,13 @@ class Controller:
 
     def validate_user_inputs(self, **kwargs):
         """Validates the user input fields."""
-        # Required Field Validation
-        defalut_fields = ['First Name', 'Last Name',
-                          'Email', 'Country Code', 'Phone Number',
-                          'Select Gender', 'Membership Type']
-
-        # Check if all required fields doesn't match the default fields
-        for field in kwargs.values():
-            if field in defalut_fields:
-                return "Please fill in all the required fields."
-
-        # Check the country code and phone number is valid
-        country_code = kwargs['country_code']
-        phone_number = kwargs['phone_number']
-
-        try:
-            # Format the phone number to international format
-            formatted_number = f"+{country_code.lstrip('+')}{phone_number}"
-            parsed_number = phonenumbers.parse(formatted_number, None)
-
-            if not phonenumbers.is_valid_number(parsed_number):
-                return "Invalid phone number."
-
-            # Check if the parsed number belongs to the selected country code
-            if parsed_number.country_code != int(country_code.lstrip('+')):
-                return "Phone number does not match the selected country code."
-
-        except phonenumbers.phonenumberutil.NumberParseException:
-            return "Invalid phone number format."
-
-        # Assuming a 10-digit phone number format
-        phone_pattern = r"^[0-9]{10}$"
-        if not re.match(phone_pattern, phone_number):
-            return "Invalid phone number format."
-
-        # Valid Characters Validation for first_name and last_name
-        name_pattern = r"^[A-Za-z\s]+$"
-        if not re.match(name_pattern, kwargs['first_name']) or \
-                not re.match(name_pattern, kwargs['last_name']):
-            return "Invalid characters in the name fields."
-
-        # Valid format for email
-        email_pattern = r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$"
-        if not re.match(email_pattern, kwargs['email']):
-            return "Invalid email format."
-
-        # Maximum Length Validation
-        max_length = 50  # Define the maximum length for fields if necessary
-        if len(kwargs['first_name']) > max_length or \
-                len(kwargs['last_name']) > max_length:
-            return "Name fields exceed the maximum length."
-        if len(kwargs['email']) > max_length:
-            return "Email field exceeds the maximum length."
+        error = validate_user_fields(**kwargs)
+        if error is not None:
+            return error
 
         # Check if phone number already exists
-        does_user_exist = self.model.get_user_by_phone_number(phone_number)
+        does_user_exist = self.model.get_user_by_phone_number(
+            kwargs['phone_number'])
         if does_user_exist:
             return "Phone number already exists."
 
@@ -330,16 +561,70 @@ class Controller:
 
     def reload(self):
         """Reloads the treeview with updated user data."""
-        # reload treeview
-        users = self.model.get_all_users()
-        if not users:
+        # Only ids and versions are loaded up front; the treeview
+        # fetches the rows it shows as they scroll into view.
+        self.sync_watermark = datetime.utcnow()
+        self.view.set_pending_users(self.model.get_pending_enrollments())
+        self.view.refresh_treeview()
+        if self.sync_after_id is None:
+            self.sync_after_id = self.view.after(USER_SYNC_INTERVAL_MS,
+                                                 self.sync_users)
+            self.event_stream.start()
+            # Operations left queued by the last session
+            self.dispatch_outbox()
+
+    def sync_users(self):
+        """Looks for users changed or deleted since the last sync on
+        the sync worker thread, then applies them to the treeview."""
+        if self.event_stream.connected and not self.sync_catch_up:
+            # Live events keep the treeview current
+            self.sync_after_id = self.view.after(USER_SYNC_INTERVAL_MS,
+                                                 self.sync_users)
             return
-
-        # print(users)
-        for user in users:
-            self.view.add_user_to_treeview(user)
-        # configure treeview
-        self.view.configure_treeview()
+        self.sync_catch_up = False
+        since = self.sync_watermark - COMMIT_LAG
+        future = self.sync_executor.submit(self.sync_users_in_worker, since)
+        future.add_done_callback(
+            lambda done: self.view.call_soon(self.finish_sync_users, done))
+
+    def sync_users_in_worker(self, since):
+        """Reads the users changed and deleted since a point in time."""
+        with self.model.scoped() as model:
+            return (model.get_users_changed_since(since),
+                    model.get_users_deleted_since(since))
+
+    def finish_sync_users(self, future):
+        """Applies the outcome of a sync and schedules the next one."""
+        if future.exception() is None:
+            users, deleted = future.result()
+            seen = [user.updated_at for user in users[-1:]] + \
+                [row.deleted_at for row in deleted[-1:]]
+            self.sync_watermark = max([self.sync_watermark] + seen)
+            if users or deleted:
+                self.view.apply_user_changes(
+                    users, [row.user_id for row in deleted])
+        else:
+            self.sync_catch_up = True
+        self.sync_after_id = self.view.after(USER_SYNC_INTERVAL_MS,
+                                             self.sync_users)
+
+    def on_events_connected(self):
+        """Asks for a catch-up sync once the event stream connects;
+        runs on the event stream thread."""
+        self.sync_catch_up = True
+
+    def on_user_event(self, kind, data):
+        """Patches the treeview row of the user an event is about;
+        runs on the event stream thread."""
+        user_id = int(data['user_id'])
+        if kind == DELETE:
+            self.view.call_soon(self.view.apply_user_changes, [], [user_id])
+            return
+        with self.model.scoped() as model:
+            users = model.get_users_by_ids([user_id])
+        # The sync watermark is left alone, so a catch-up sync still
+        # finds the changes made while the stream was disconnected.
+        self.view.call_soon(self.view.apply_user_changes, users, [])
 
     def get_user_by_id(self, user_id):
         """Retrieves a user object from the database based on
@@ -351,6 +636,50 @@ class Controller:
         """Retrieves all users from the database."""
         return self.model.get_all_users()
 
+    def get_user_versions(self):
+        """Retrieves (id, updated_at) pairs of all users."""
+        return self.model.get_user_versions()
+
+    def get_users_by_ids(self, user_ids):
+        """Retrieves the users with the given ids."""
+        return self.model.get_users_by_ids(user_ids)
+
+    def search_users(self, query, limit=SEARCH_PAGE_SIZE, offset=0):
+        """Retrieves a page of users whose name, email or phone number
+        starts with the words of the query."""
+        return self.model.search_users(query, limit, offset)
+
+    def search_users_in_background(self, query, callback):
+        """Searches for the first page of users matching the query on
+        the search worker thread, then calls callback with the users on
+        the Tk main loop. Returns the future of the search, which can be
+        cancelled until it starts."""
+        future = self.search_executor.submit(self.search_users_in_worker,
+                                             query)
+
+        def on_done(done):
+            if not done.cancelled() and done.exception() is None:
+                self.view.call_soon(callback, done.result())
+        future.add_done_callback(on_done)
+        return future
+
+    def search_users_in_worker(self, query):
+        """Runs a search for the first page of matches."""
+        with self.model.scoped() as model:
+            return model.search_users(query, SEARCH_PAGE_SIZE)
+
     def run(self) -> None:
         """Runs the GUI."""
         self.view.mainloop()
+
+    def shutdown(self):
+        """Stops the background work, so the process exits once the
+        window is gone. Operations still queued stay in the outbox."""
+        self.event_stream.stop()
+        self.outbox.stop()
+        if self.io_on_cancel is not None:
+            # Reports and imports stop at their next chunk
+            self.io_on_cancel()
+        for executor in (self.search_executor, self.io_executor,
+                         self.report_executor, self.sync_executor):
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,111 @@
+"""This module contains the DeviceClient class."""
+
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class DeviceUnavailable(Exception):
+    """Raised when the device cannot be reached, is busy, or its
+    circuit breaker is open."""
+
+
+class DeviceClient:
+    """A pooled, keep-alive HTTP client for the ESP32 fingerprint scanner.
+
+    Connections are reused through one requests.Session, every call has
+    connect and read timeouts, and the number of concurrent calls to the
+    device is bounded. After failure_threshold consecutive connection
+    errors the circuit opens: calls fail fast with DeviceUnavailable and
+    a background thread probes the device every reset_timeout seconds
+    until it answers again.
+    """
+
+    def __init__(self, base_url, connect_timeout=3.05, read_timeout=30.0,
+                 max_concurrency=1, failure_threshold=3,
+                 reset_timeout=10.0) -> None:
+        """Initialize the DeviceClient class."""
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=max_concurrency)
+        self.session.mount('http://', adapter)
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.is_open = False
+
+    @classmethod
+    def from_config(cls, config, section='Esp32'):
+        """Create a client from a section of the configuration file."""
+        return cls(
+            f"http://{config.get_value(section, 'ip')}",
+            connect_timeout=float(
+                config.get_value(section, 'connect_timeout')),
+            read_timeout=float(config.get_value(section, 'read_timeout')),
+            max_concurrency=int(config.get_value(section, 'max_concurrency')),
+            failure_threshold=int(
+                config.get_value(section, 'failure_threshold')),
+            reset_timeout=float(config.get_value(section, 'reset_timeout')))
+
+    def get(self, path, **kwargs):
+        """Send a GET request to the device and return the response.
+
+        Raises DeviceUnavailable instead of waiting when the circuit is
+        open, when all connection slots stay busy for a full read
+        timeout, or when the request itself cannot be completed."""
+        if self.is_open:
+            raise DeviceUnavailable('Device is unreachable.')
+        if not self.slots.acquire(timeout=self.timeout[1]):
+            raise DeviceUnavailable('Device is busy.')
+        try:
+            response = self.session.get(
+                self.base_url + path, timeout=self.timeout, **kwargs)
+        except requests.RequestException as error:
+            self.record_failure()
+            raise DeviceUnavailable(str(error)) from error
+        finally:
+            self.slots.release()
+        self.record_success()
+        return response
+
+    def record_success(self):
+        """Reset the failure count after the device answered."""
+        with self.lock:
+            self.failures = 0
+
+    def record_failure(self):
+        """Count a failed call and open the circuit at the threshold."""
+        with self.lock:
+            self.failures += 1
+            if self.is_open or self.failures < self.failure_threshold:
+                return
+            self.is_open = True
+        threading.Thread(target=self.probe, daemon=True).start()
+
+    def probe(self):
+        """Poll the device in the background until it answers,
+        then close the circuit."""
+        while True:
+            time.sleep(self.reset_timeout)
+            try:
+                # Any HTTP answer, even an error status, means the
+                # device is reachable again.
+                self.session.get(self.base_url + '/',
+                                 timeout=(self.timeout[0], self.timeout[0]))
+            except requests.RequestException:
+                continue
+            with self.lock:
+                self.failures = 0
+                self.is_open = False
+            return
+
+    def close(self):
+        """Close the pooled connections."""
+        self.session.close()
@@ -0,0 +1,82 @@
+"""This module contains the EventStream class."""
+
+import json
+import logging
+import threading
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class EventStream:
+    """Follow a text/event-stream from a background thread.
+
+    on_event(kind, data) is called on that thread for every event and
+    on_connect() every time the stream (re)connects. An event that fails
+    to parse or to handle is logged and skipped. Dropped connections are
+    retried after a delay that doubles up to max_backoff seconds.
+    """
+
+    def __init__(self, url, on_event, on_connect=None, connect_timeout=3.05,
+                 read_timeout=45.0, max_backoff=30.0) -> None:
+        """Initialize the EventStream class."""
+        self.url = url
+        self.on_event = on_event
+        self.on_connect = on_connect
+        # The server sends a heartbeat well within read_timeout
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_backoff = max_backoff
+        self.connected = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, name='events', daemon=True)
+
+    def start(self):
+        """Start following the stream."""
+        self.thread.start()
+
+    def stop(self):
+        """Stop following the stream after the next event or timeout."""
+        self.stopped.set()
+
+    def run(self):
+        """Connect, read events, and reconnect until stopped."""
+        backoff = 1.0
+        while not self.stopped.is_set():
+            try:
+                with requests.get(self.url, stream=True,
+                                  timeout=self.timeout) as response:
+                    response.raise_for_status()
+                    self.connected = True
+                    backoff = 1.0
+                    if self.on_connect:
+                        self.on_connect()
+                    self.read_events(response)
+            except requests.RequestException:
+                pass
+            finally:
+                self.connected = False
+            self.stopped.wait(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def read_events(self, response):
+        """Parse the stream and hand each complete event to on_event."""
+        kind, data = 'message', []
+        for line in response.iter_lines(decode_unicode=True):
+            if self.stopped.is_set():
+                return
+            if not line:
+                if data:
+                    self.dispatch(kind, '\n'.join(data))
+                kind, data = 'message', []
+            elif line.startswith('event:'):
+                kind = line[6:].strip()
+            elif line.startswith('data:'):
+                data.append(line[5:].strip())
+
+    def dispatch(self, kind, data):
+        """Hand one event to on_event, logging it instead if it fails."""
+        try:
+            self.on_event(kind, json.loads(data))
+        except Exception:
+            logger.exception("Skipped a %s event: %s", kind, data)
@@ -0,0 +1,81 @@
+"""This module contains the EventBus class."""
+
+import itertools
+import json
+import queue
+import threading
+
+CHECKIN = 'checkin'
+ENROLL = 'enroll'
+DELETE = 'delete'
+
+
+class Subscription:
+    """The events waiting to be sent to one subscriber."""
+
+    def __init__(self, max_queued) -> None:
+        """Initialize the Subscription class."""
+        self.events = queue.Queue(max_queued)
+        # Set when the subscriber fell too far behind and was dropped
+        self.dropped = False
+
+
+class EventBus:
+    """Fan out events published by request handlers to every
+    subscriber, as a text/event-stream.
+
+    Publishing never blocks: a subscriber with max_queued unsent events
+    is dropped, and its stream ends once the queued events are sent so
+    the client reconnects and catches up."""
+
+    def __init__(self, max_queued=1000, heartbeat=15.0) -> None:
+        """Initialize the EventBus class."""
+        self.max_queued = max_queued
+        self.heartbeat = heartbeat
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+    def subscribe(self):
+        """Return a new Subscription to all events published from now."""
+        subscription = Subscription(self.max_queued)
+        with self.lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stop sending events to a subscription."""
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def publish(self, kind, **data):
+        """Send an event of the given kind to every subscriber."""
+        with self.lock:
+            event = (next(self.ids), kind, data)
+            for subscription in list(self.subscriptions):
+                try:
+                    subscription.events.put_nowait(event)
+                except queue.Full:
+                    subscription.dropped = True
+                    self.subscriptions.discard(subscription)
+
+    def stream(self):
+        """Yield the events of a new subscription in text/event-stream
+        format, with a comment line every heartbeat seconds so closed
+        connections are noticed."""
+        subscription = self.subscribe()
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    event_id, kind, data = subscription.events.get(
+                        timeout=self.heartbeat)
+                except queue.Empty:
+                    if subscription.dropped:
+                        return
+                    yield ': heartbeat\n\n'
+                    continue
+                yield (f'id: {event_id}\nevent: {kind}\n'
+                       f'data: {json.dumps(data)}\n\n')
+        finally:
+            self.unsubscribe(subscription)
@@ -0,0 +1,228 @@
+"""This module exports the members to files in several formats.
+
+Every exporter reads the same stream of user rows, such as
+Model.iter_users, and writes it out one row at a time, so memory use
+does not grow with the number of users. Exporters are registered by
+file extension in EXPORTERS; export() picks one from the file name.
+"""
+
+from collections import namedtuple
+from datetime import date, datetime
+import csv
+import importlib.util
+import json
+import os
+import xlsxwriter
+
+from sqlalchemy import DateTime, Integer
+from iFlask_app.user_model import User
+
+# Rows written between progress reports and cancellation checks
+PROGRESS_EVERY = 1000
+# Rows per worksheet allowed by Excel, the header row included
+XLSX_MAX_ROWS = 1048576
+# Rows per Parquet row group
+PARQUET_BATCH_ROWS = 16384
+
+HEADERS = ['User ID', 'First Name', 'Last Name',
+           'Email', 'Country Code', 'Phone Number',
+           'Gender', 'Last Check In', 'Membership Type',
+           'Next Payment', 'Start Date', 'Updated Date',
+           'Remaining Days'
+           ]
+COLUMN_WIDTHS = [10, 15, 15, 35, 12,
+                 15, 10, 15, 15, 15, 12, 12, 15]
+# Columns of the formats that export users as stored
+COLUMNS = [column.name for column in User.__table__.columns]
+
+# description: shown in the save dialog; requires: module the format
+# needs, or None
+Exporter = namedtuple('Exporter', ['description', 'write', 'requires'])
+EXPORTERS = {}
+
+
+class ExportCancelled(Exception):
+    """Raised inside an exporter when the export was cancelled."""
+
+
+def exporter(extension, description, requires=None):
+    """Register the decorated function as the exporter for files with
+    the given extension."""
+    def register(write):
+        EXPORTERS[extension] = Exporter(description, write, requires)
+        return write
+    return register
+
+
+def available_formats(formats=EXPORTERS):
+    """Return (description, extension) pairs of the formats of a
+    registry, EXPORTERS or importer.READERS, whose dependencies are
+    installed."""
+    return [(found.description, extension)
+            for extension, found in formats.items()
+            if found.requires is None
+            or importlib.util.find_spec(found.requires) is not None]
+
+
+def export(file_path, users, total, attendance=None, progress=None,
+           is_cancelled=None):
+    """Export users to file_path in the format of its extension.
+
+    users is an iterable of rows with the User columns and total their
+    number. attendance optionally maps sheet names to summary rows, for
+    the formats that have sheets. progress(fraction) is called every
+    PROGRESS_EVERY users; once is_cancelled() returns True the partial
+    file is removed and None is returned. Otherwise returns the number
+    of users written."""
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension not in EXPORTERS:
+        raise ValueError(f"Unsupported export format: {extension}")
+
+    written = 0
+
+    def tracked():
+        nonlocal written
+        for index, user in enumerate(users, start=1):
+            yield user
+            # Asked for the next user, so this one was written
+            written = index
+            if index % PROGRESS_EVERY == 0:
+                if is_cancelled and is_cancelled():
+                    raise ExportCancelled()
+                if progress:
+                    progress(min(1.0, index / total))
+
+    try:
+        EXPORTERS[extension].write(file_path, tracked(), attendance)
+    except ExportCancelled:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        return None
+    return written
+
+
+def report_row(user):
+    """Return the report cells of a user."""
+    return [
+        user.id,
+        user.first_name,
+        user.last_name,
+        user.email,
+        '+' + str(user.country_code),
+        user.phone_number,
+        user.gender,
+        str(user.last_check_in).split()[
+            0] if user.last_check_in else '',
+        user.membership_type,
+        str(user.next_payment).split()[
+            0] if user.next_payment else '',
+        str(user.created_at).split()[0] if user.created_at else '',
+        str(user.updated_at).split()[0] if user.updated_at else '',
+        str(user.remaining_days).split()[
+            0] if user.remaining_days else '',
+    ]
+
+
+def plain_value(value):
+    """Return a column value as plain text-friendly data."""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+@exporter('.xlsx', 'Excel workbook')
+def write_xlsx(file_path, users, attendance=None):
+    """Write the users, then the attendance summary sheets, to an Excel
+    workbook in xlsxwriter's constant_memory mode. Users past the row
+    limit of a worksheet continue on the next one."""
+    workbook = xlsxwriter.Workbook(file_path, {'constant_memory': True})
+    try:
+        # Create header format
+        header_format = workbook.add_format({
+            'bold': True,
+            'font_color': 'white',
+            'bg_color': '#1E90FF',
+            'border': 1
+        })
+
+        # Create data format
+        data_format = workbook.add_format({'border': 1})
+
+        worksheet = None
+        row = XLSX_MAX_ROWS
+        for user in users:
+            if row == XLSX_MAX_ROWS:
+                worksheet = workbook.add_worksheet()
+                for col, width in enumerate(COLUMN_WIDTHS):
+                    worksheet.set_column(col, col, width)
+                worksheet.write_row('A1', HEADERS, header_format)
+                row = 1
+            worksheet.write_row(row, 0, report_row(user), data_format)
+            row += 1
+
+        # Write attendance summary sheets
+        for sheet_name, rows in (attendance or {}).items():
+            summary_sheet = workbook.add_worksheet(sheet_name)
+            summary_sheet.set_column(0, 4, 16)
+            if not rows:
+                continue
+            summary_sheet.write_row(
+                'A1', [field.replace('_', ' ').title()
+                       for field in rows[0]._fields], header_format)
+            for index, summary in enumerate(rows, start=1):
+                # The first column is the day
+                summary_sheet.write_row(
+                    index, 0, [str(summary[0]), *summary[1:]], data_format)
+    finally:
+        workbook.close()
+
+
+@exporter('.csv', 'CSV')
+def write_csv(file_path, users, attendance=None):
+    """Write the user columns to a CSV file with a header row."""
+    with open(file_path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(COLUMNS)
+        for user in users:
+            writer.writerow([plain_value(value) for value in user])
+
+
+@exporter('.jsonl', 'JSON Lines')
+def write_jsonl(file_path, users, attendance=None):
+    """Write one JSON object of user columns per line."""
+    with open(file_path, 'w', encoding='utf-8') as file:
+        for user in users:
+            file.write(json.dumps(
+                {column: plain_value(value)
+                 for column, value in zip(COLUMNS, user)}))
+            file.write('\n')
+
+
+@exporter('.parquet', 'Parquet (zstd)', requires='pyarrow')
+def write_parquet(file_path, users, attendance=None):
+    """Write the user columns to a zstd compressed Parquet file for
+    archival, PARQUET_BATCH_ROWS users per row group."""
+    import pyarrow
+    import pyarrow.parquet
+
+    schema = pyarrow.schema([
+        (column.name, pyarrow.int64() if isinstance(column.type, Integer)
+         else pyarrow.timestamp('us') if isinstance(column.type, DateTime)
+         else pyarrow.string())
+        for column in User.__table__.columns])
+    with pyarrow.parquet.ParquetWriter(file_path, schema,
+                                       compression='zstd') as writer:
+        batch = []
+        for user in users:
+            batch.append(user)
+            if len(batch) == PARQUET_BATCH_ROWS:
+                writer.write_table(parquet_table(pyarrow, schema, batch))
+                batch = []
+        writer.write_table(parquet_table(pyarrow, schema, batch))
+
+
+def parquet_table(pyarrow, schema, batch):
+    """Return a batch of users as an Arrow table, column by column."""
+    return pyarrow.Table.from_arrays(
+        [pyarrow.array([user[index] for user in batch], type=field.type)
+         for index, field in enumerate(schema)], schema=schema)
@@ -0,0 +1,71 @@
+"""A fake ESP32 fingerprint scanner for local development.
+
+It answers the same endpoints as the real device, so the API can be run
+against it by setting the [Esp32] ip in settings/config.ini to, for
+example, 127.0.0.1:8080:
+
+    python -m iFlask_app.fake_esp32 --port 8080 --delay 2
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import argparse
+import time
+
+
+class FakeEsp32Handler(BaseHTTPRequestHandler):
+    """Handle requests the way the ESP32 firmware does."""
+
+    # Keep connections open so the client's connection reuse shows up
+    protocol_version = 'HTTP/1.1'
+    # Seconds to wait before answering, e.g. to mimic finger presses
+    delay = 0.0
+    # HTTP status returned by the enroll and delete endpoints
+    status = 200
+
+    def do_GET(self):
+        """Answer enroll_user, delete_user and health probes."""
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path in ('/enroll_user', '/delete_user'):
+            time.sleep(self.delay)
+            self.reply(self.status, f"{url.path[1:]} {params}")
+        else:
+            self.reply(200, 'ok')
+
+    def reply(self, status, text):
+        """Send a plain text response."""
+        body = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(host='127.0.0.1', port=0, delay=0.0, status=200):
+    """Create a fake ESP32 server; port 0 picks a free port."""
+    handler = type('Handler', (FakeEsp32Handler,),
+                   {'delay': delay, 'status': status})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    """Run the fake ESP32 server until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--delay', type=float, default=0.0)
+    parser.add_argument('--status', type=int, default=200)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.delay, args.status)
+    print(f"Fake ESP32 listening on {server.server_address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
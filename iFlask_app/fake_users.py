@@ -1,68 +1,295 @@
-"""This script generates fake user data using the Faker library."""
+"""This module generates fake members and their check-in history.
 
-from faker import Faker
-from datetime import datetime
-import phonenumbers
+Members are drawn from Faker's name pools with a random generator
+seeded per block of user ids, so the same seed and end date always give
+the same members and check-ins, whatever the number of worker
+processes. Phone numbers come from ranges that phonenumbers accepts,
+one per country, and are unique by construction instead of by
+checking every candidate.
 
-fake = Faker()
+    python -m iFlask_app.fake_users OUTPUT [--users N] [--years N]
+        [--visits-per-week N] [--seed N] [--workers N] [--force]
 
-fake_user_list = []
+writes a fresh SQLite database at OUTPUT: blocks of members are
+generated in worker processes, each into a separate shard file, and
+bulk loaded with INSERT ... SELECT. The migrations then fill the
+attendance rollups and build the search index, and the planner
+statistics are gathered once at the end.
+"""
 
-while len(fake_user_list) < 10:
-    # Generate random user data using the Faker library
-    first_name = fake.first_name()
-    last_name = fake.last_name()
-    email = fake.email()
-    country_code = fake.country_calling_code()
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
 
-    phone_number = fake.random_int(
-        min=1000000000, max=9999999999)
+from faker.providers.person.en_US import Provider
 
-    gender = fake.random_element(elements=('Male', 'Female'))
+# Users generated per worker task and per random seed
+BLOCK_SIZE = 20000
+# Check-ins a worker holds before writing them to its shard
+WRITE_CHUNK_SIZE = 50000
+# (country_code, first phone number) of ranges holding MAX_PER_COUNTRY
+# valid numbers that do not overlap
+COUNTRIES = ((1, 2012000000), (44, 7400000000),
+             (52, 5512000000), (91, 9000000000))
+MAX_PER_COUNTRY = 7999999
+MAX_USERS = len(COUNTRIES) * MAX_PER_COUNTRY
+DOMAINS = ('example.com', 'example.org', 'example.net')
+FIRST_NAMES_MALE = tuple(Provider.first_names_male)
+FIRST_NAMES_FEMALE = tuple(Provider.first_names_female)
+LAST_NAMES = tuple(Provider.last_names)
+# Relative number of check-ins per hour of the day, busiest before and
+# after work
+HOUR_WEIGHTS = (0, 0, 0, 0, 0, 1, 6, 8, 6, 4, 3, 3,
+                4, 3, 2, 3, 5, 9, 10, 8, 5, 3, 1, 0)
+MEMBER_SHARE = 0.7
+DEVICES = ('esp32-1', 'esp32-2')
 
-    last_check_in = fake.date_time_this_month(
-        before_now=True, after_now=False)
+USER_COLUMNS = ('id', 'first_name', 'last_name', 'email', 'country_code',
+                'phone_number', 'gender', 'last_check_in',
+                'membership_type', 'next_payment', 'remaining_days',
+                'created_at', 'updated_at')
 
-    membership_type = fake.random_element(
-        elements=('Member', 'Not Member'))
 
-    next_payment = fake.date_time_this_decade(
-        before_now=False, after_now=True)
+def timestamp(moment):
+    """Return a datetime as SQLAlchemy stores it in SQLite."""
+    return moment.isoformat(sep=' ', timespec='microseconds')
 
-    remaining_days = fake.random_int(min=30, max=31)
 
-    created_at = datetime.utcnow()
-    updated_at = datetime.utcnow()
+@lru_cache(maxsize=None)
+def day_text(ordinal):
+    """Return the date with the given ordinal as text."""
+    return date.fromordinal(ordinal).isoformat()
 
-    full_phone_number = f"+{country_code} {phone_number}"
 
-    # Exclude phone numbers in the format "+882 16 xxxxxxxxxx"
-    if country_code == '+882 16':
-        continue
+def generate_block(seed, first_id, count, until, years=2.0,
+                   visits_per_week=2.0):
+    """Yield (user, checkins) for the users with ids from first_id: a
+    dict of User columns and a list of (user_id, ts, device_id).
 
+    Members joined at some point in the years before until and have
+    checked in on about visits_per_week days a week since, each
+    member at their own rate around it."""
+    rng = random.Random(f'{seed}:{first_id}')
+    start = until - timedelta(days=365 * years)
+    history = (until - start).total_seconds()
+    for user_id in range(first_id, first_id + count):
+        gender = rng.choice(('Male', 'Female'))
+        first_name = rng.choice(FIRST_NAMES_MALE if gender == 'Male'
+                                else FIRST_NAMES_FEMALE)
+        last_name = rng.choice(LAST_NAMES)
+        country_code, first_phone = COUNTRIES[
+            (user_id - 1) % len(COUNTRIES)]
+        created_at = start + timedelta(seconds=rng.uniform(0, history))
+
+        # Whole days between joining and until
+        days = range(1, (until - created_at).days)
+        visits = min(len(days), round(
+            len(days) / 7 * rng.uniform(0, 2 * visits_per_week)))
+        checkins = []
+        visited = sorted(rng.sample(days, visits))
+        hours = rng.choices(range(24), HOUR_WEIGHTS, k=visits)
+        seconds = rng.choices(range(3600), k=visits)
+        devices = rng.choices(DEVICES, k=visits)
+        # Formatted by hand, as timestamp() would, at millions of rows
+        joined = created_at.toordinal()
+        for day, hour, second, device in zip(visited, hours, seconds,
+                                             devices):
+            checkins.append((
+                user_id, f'{day_text(joined + day)} {hour:02d}:'
+                f'{second // 60:02d}:{second % 60:02d}.000000', device))
+        last_check_in = checkins[-1][1] if visits else None
+
+        yield {
+            'id': user_id,
+            'first_name': first_name,
+            'last_name': last_name,
+            'email': f'{first_name}.{last_name}{user_id}@'
+                     f'{rng.choice(DOMAINS)}'.lower(),
+            'country_code': country_code,
+            'phone_number': first_phone + (user_id - 1) // len(COUNTRIES),
+            'gender': gender,
+            'last_check_in': last_check_in,
+            'membership_type': 'Member' if rng.random() < MEMBER_SHARE
+            else 'Not Member',
+            'next_payment': timestamp(
+                until + timedelta(days=rng.randrange(-30, 31))),
+            'remaining_days': rng.randrange(0, 32),
+            'created_at': timestamp(created_at),
+            'updated_at': last_check_in or timestamp(created_at),
+        }, checkins
+
+
+def generate_users(count, seed=0, until=None):
+    """Yield count users as dicts of User columns without their ids,
+    for adding to an existing database."""
+    until = until or datetime.utcnow()
+    for first_id in range(1, count + 1, BLOCK_SIZE):
+        for user, _ in generate_block(seed, first_id,
+                                      min(BLOCK_SIZE, count + 1 - first_id),
+                                      until):
+            user.pop('id')
+            for column in ('last_check_in', 'next_payment',
+                           'created_at', 'updated_at'):
+                if user[column] is not None:
+                    user[column] = datetime.fromisoformat(user[column])
+            yield user
+
+
+def write_shard(path, seed, first_id, count, until, years,
+                visits_per_week):
+    """Generate a block of users into a shard file at path and return
+    the path (worker process).
+
+    Users and check-ins are written every WRITE_CHUNK_SIZE check-ins,
+    so memory does not grow with the length of the history."""
+    users = []
+    checkins = []
+
+    def write():
+        connection.executemany(
+            f"INSERT INTO users VALUES "
+            f"({', '.join(':' + column for column in USER_COLUMNS)})",
+            users)
+        connection.executemany(
+            "INSERT INTO checkins VALUES (?, ?, ?)", checkins)
+        users.clear()
+        checkins.clear()
+
+    with sqlite3.connect(path) as connection:
+        connection.execute(f"CREATE TABLE users ({', '.join(USER_COLUMNS)})")
+        connection.execute(
+            "CREATE TABLE checkins (user_id, ts, device_id)")
+        for user, visits in generate_block(seed, first_id, count, until,
+                                           years, visits_per_week):
+            users.append(user)
+            checkins += visits
+            if len(checkins) >= WRITE_CHUNK_SIZE:
+                write()
+        write()
+    connection.close()
+    return path
+
+
+def load_shards(connection, users, seed, years, visits_per_week, workers,
+                until, progress=None):
+    """Generate the users in blocks on worker processes and load each
+    shard they write into the database of connection, in id order."""
+    loaded = 0
+    with tempfile.TemporaryDirectory(prefix='iflask-shards-') as shards, \
+            ProcessPoolExecutor(workers, mp_context=multiprocessing
+                                .get_context('spawn')) as pool:
+        pending = deque()
+        blocks = iter(range(1, users + 1, BLOCK_SIZE))
+        while True:
+            # Keep every worker busy, with one more block each queued
+            for first_id in blocks:
+                pending.append(pool.submit(
+                    write_shard, os.path.join(shards, f'{first_id}.db'),
+                    seed, first_id, min(BLOCK_SIZE, users + 1 - first_id),
+                    until, years, visits_per_week))
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                return
+            shard = pending.popleft().result()
+            connection.execute("ATTACH DATABASE ? AS shard", (shard,))
+            connection.execute("BEGIN")
+            loaded += connection.execute(
+                f"INSERT INTO users ({', '.join(USER_COLUMNS)}) "
+                f"SELECT * FROM shard.users").rowcount
+            connection.execute("INSERT INTO checkins (user_id, ts, device_id) "
+                               "SELECT * FROM shard.checkins")
+            connection.execute("COMMIT")
+            connection.execute("DETACH DATABASE shard")
+            os.remove(shard)
+            if progress:
+                progress(loaded)
+
+
+def generate_database(path, users, seed=0, years=2.0, visits_per_week=2.0,
+                      workers=None, until=None, progress=None):
+    """Write a fresh database of generated users and check-ins at path.
+
+    until defaults to the start of today, UTC. progress(count) is called
+    with the number of users loaded after every block. If generation
+    fails, the partial file is removed."""
+    # Imported here so the worker processes, which import this module,
+    # do not set up the app's engine
+    from iFlask_app.user_model import Base, User, CheckIn, make_engine
+    from iFlask_app.migrations import Migrator
+
+    if os.path.exists(path):
+        raise FileExistsError(path)
+    if users > MAX_USERS:
+        raise ValueError(f"At most {MAX_USERS} users can be generated.")
+    until = until or datetime.combine(datetime.utcnow().date(),
+                                      datetime.min.time())
+    engine = make_engine(f'sqlite:///{path}')
+    # Indexes are built once from sorted data rather than row by row
+    indexes = [*User.__table__.indexes, *CheckIn.__table__.indexes]
     try:
-        # Validate the phone number using phonenumbers library
-        parsed_number = phonenumbers.parse(full_phone_number, None)
-        if phonenumbers.is_valid_number(parsed_number):
-            # Create a dictionary representing the fake user data
-            user_dict = {
-                'first_name': first_name,
-                'last_name': last_name,
-                'email': email,
-                'country_code': country_code,
-                'phone_number': phone_number,
-                'gender': gender,
-                'last_check_in': last_check_in,
-                'membership_type': membership_type,
-                'next_payment': next_payment,
-                'remaining_days': remaining_days,
-                'created_at': created_at,
-                'updated_at': updated_at
-            }
-            # Exclude repetitions in the dictionary and add
-            #  the fake user data to the list
-            if user_dict not in fake_user_list:
-                fake_user_list.append(user_dict)
-    except phonenumbers.phonenumberutil.NumberParseException:
-        # Ignore invalid phone numbers that couldn't be parsed
-        pass
+        Base.metadata.create_all(engine)
+        for index in indexes:
+            index.drop(engine)
+        connection = sqlite3.connect(path, isolation_level=None)
+        try:
+            # A failed load is thrown away, so nothing is journaled
+            connection.execute("PRAGMA journal_mode = OFF")
+            connection.execute("PRAGMA synchronous = OFF")
+            load_shards(connection, users, seed, years, visits_per_week,
+                        workers or os.cpu_count() or 1, until, progress)
+        finally:
+            connection.close()
+        for index in indexes:
+            index.create(engine)
+        # Fills the attendance rollups and builds the search index from
+        # the loaded rows
+        Migrator(engine).run()
+        with engine.begin() as analyze:
+            analyze.exec_driver_sql("ANALYZE")
+    except BaseException:
+        engine.dispose()
+        os.remove(path)
+        raise
+    engine.dispose()
+
+
+def main():
+    """Generate a database from the command line."""
+    parser = argparse.ArgumentParser(
+        description="Generate a database of fake members and check-ins.")
+    parser.add_argument('output', help="SQLite file to create")
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--years', type=float, default=2.0,
+                        help="years of check-in history")
+    parser.add_argument('--visits-per-week', type=float, default=2.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument('--until',
+                        help="end of the history, YYYY-MM-DD (default: "
+                        "today); fix it for identical databases")
+    parser.add_argument('--force', action='store_true',
+                        help="replace OUTPUT if it exists")
+    args = parser.parse_args()
+
+    if args.force and os.path.exists(args.output):
+        os.remove(args.output)
+    until = datetime.fromisoformat(args.until) if args.until else None
+    started = datetime.utcnow()
+    generate_database(
+        args.output, args.users, args.seed, args.years,
+        args.visits_per_week, args.workers, until,
+        progress=lambda count: print(f"{count} users loaded", flush=True))
+    print(f"Done in {(datetime.utcnow() - started).total_seconds():.1f} s")
+
+
+if __name__ == "__main__":
+    main()
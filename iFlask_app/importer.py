@@ -0,0 +1,230 @@
+"""This module imports members from the rosters of other gym systems.
+
+Rows are streamed from a CSV file or an Excel workbook and validated
+with the rules of the enrollment form in worker processes. The phone
+numbers of each chunk are checked against the database with a single
+query, and the accepted rows are bulk inserted. Rejected rows are
+written, with the reason, to a CSV file next to the roster.
+
+The columns are found by their header, so a roster may have them in any
+order, along with others that are ignored. "First Name" and first_name
+are the same column, which makes the files written by exporters
+importable too.
+"""
+
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import csv
+import multiprocessing
+import os
+
+from iFlask_app.validation import validate_user_fields
+
+# Rows validated, checked and inserted together
+IMPORT_CHUNK_SIZE = 1000
+# Chunks queued per worker process, enough to keep them busy while
+# the previous chunk is inserted
+CHUNKS_PER_WORKER = 2
+# Columns a roster must have
+FIELDS = ('first_name', 'last_name', 'email', 'country_code',
+          'phone_number', 'gender', 'membership_type')
+# Given to members whose roster row has no remaining_days, as enrolling
+# them from the form does
+DEFAULT_REMAINING_DAYS = 30
+# Appended to the roster's file name, extension included, so rosters
+# that differ only by format keep their own rejects
+REJECT_SUFFIX = '.rejects.csv'
+
+# read(file_path) yields (row_number, dict) pairs, numbered as in the
+# file with the header as row 1; count(file_path) returns the number of
+# rows, for progress
+Reader = namedtuple('Reader', ['description', 'read', 'count', 'requires'])
+ImportResult = namedtuple('ImportResult',
+                          ['imported', 'rejected', 'reject_path',
+                           'completed'])
+
+
+def column_name(header):
+    """Return the column a header names: 'Phone Number' is
+    phone_number."""
+    return str(header or '').strip().lower().replace(' ', '_')
+
+
+def read_csv(file_path):
+    """Yield the numbered rows of a CSV roster with a header row."""
+    with open(file_path, newline='', encoding='utf-8-sig') as file:
+        rows = csv.reader(file)
+        headers = [column_name(header) for header in next(rows, [])]
+        for row_number, values in enumerate(rows, start=2):
+            if any(values):
+                yield row_number, dict(zip(headers, values))
+
+
+def count_csv_rows(file_path):
+    """Return the number of rows of a CSV roster, without the header."""
+    with open(file_path, newline='', encoding='utf-8-sig') as file:
+        return max(0, sum(1 for _ in csv.reader(file)) - 1)
+
+
+def read_xlsx(file_path):
+    """Yield the numbered rows of the first worksheet of an Excel
+    roster with a header row, in openpyxl's read-only mode."""
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(file_path, read_only=True,
+                                      data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        headers = [column_name(header) for header in next(rows, ())]
+        for row_number, values in enumerate(rows, start=2):
+            if any(value is not None for value in values):
+                yield row_number, dict(zip(headers, values))
+    finally:
+        workbook.close()
+
+
+def count_xlsx_rows(file_path):
+    """Return the number of rows of an Excel roster, without the
+    header, as recorded in the worksheet's dimensions."""
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(file_path, read_only=True)
+    try:
+        return max(0, (workbook.worksheets[0].max_row or 1) - 1)
+    finally:
+        workbook.close()
+
+
+READERS = {
+    '.csv': Reader('CSV', read_csv, count_csv_rows, None),
+    '.xlsx': Reader('Excel workbook', read_xlsx, count_xlsx_rows,
+                    'openpyxl'),
+}
+
+
+def cell_text(value):
+    """Return a cell as the text an entry field would hold."""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        # Excel stores phone numbers as floats
+        value = int(value)
+    return str(value).strip()
+
+
+def prepare_row(row):
+    """Return the member in a roster row as the enrollment form gives
+    it to validation."""
+    user = {field: cell_text(row.get(field)) for field in FIELDS}
+    # Phone numbers are stored as integers, so those of the app's own
+    # reports lose their leading zero; put it back as the form does
+    if len(user['phone_number']) == 9 and user['phone_number'].isdigit():
+        user['phone_number'] = '0' + user['phone_number']
+    user['first_name'] = user['first_name'].lower().title()
+    user['last_name'] = user['last_name'].lower().title()
+    user['remaining_days'] = cell_text(row.get('remaining_days')) or \
+        str(DEFAULT_REMAINING_DAYS)
+    return user
+
+
+def validate_chunk(rows):
+    """Validate a chunk of roster rows and return a (user, error) pair
+    for each; error is None for valid rows (worker process)."""
+    results = []
+    for row in rows:
+        user = prepare_row(row)
+        missing = [field for field in FIELDS if not user[field]]
+        if missing:
+            error = f"Missing {', '.join(missing)}."
+        elif not user['remaining_days'].isdigit():
+            error = "Invalid remaining days."
+        else:
+            error = validate_user_fields(**user)
+        results.append((user, error))
+    return results
+
+
+def user_columns(user):
+    """Return a validated member as the values of the User columns."""
+    return {**user,
+            'country_code': int(user['country_code'].lstrip('+')),
+            'phone_number': int(user['phone_number']),
+            'remaining_days': int(user['remaining_days'])}
+
+
+def import_users(file_path, model, progress=None, is_cancelled=None,
+                 max_workers=None, chunk_size=IMPORT_CHUNK_SIZE):
+    """Import the members of the roster at file_path with the given
+    Model.
+
+    Phone numbers already in the database or earlier in the roster are
+    rejected, like everything validate_user_fields rejects. Every chunk
+    is inserted in a transaction of its own, so once is_cancelled()
+    returns True the import stops with the chunks before it kept.
+    progress(fraction) is called after every chunk. Returns an
+    ImportResult; reject_path is None if no row was rejected."""
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension not in READERS:
+        raise ValueError(f"Unsupported roster format: {extension}")
+    reader = READERS[extension]
+    total = reader.count(file_path)
+    rows = reader.read(file_path)
+    workers = max_workers or os.cpu_count() or 1
+    reject_path = file_path + REJECT_SUFFIX
+    seen = set()
+    imported = rejected = 0
+    completed = True
+
+    # Spawned workers, as the GUI calls this with Tk threads running
+    pool = ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        with open(reject_path, 'w', newline='', encoding='utf-8') as file:
+            rejects = csv.writer(file)
+            rejects.writerow(['row', *FIELDS, 'remaining_days', 'error'])
+            pending = deque()
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if chunk:
+                    row_numbers, chunk = zip(*chunk)
+                    pending.append((row_numbers, pool.submit(
+                        validate_chunk, list(chunk))))
+                    if len(pending) < workers * CHUNKS_PER_WORKER:
+                        continue
+                if not pending:
+                    break
+                if is_cancelled and is_cancelled():
+                    completed = False
+                    break
+
+                row_numbers, future = pending.popleft()
+                results = future.result()
+                existing = model.get_existing_phone_numbers(
+                    {int(user['phone_number'])
+                     for user, error in results if error is None})
+                accepted = []
+                for row_number, (user, error) in zip(row_numbers, results):
+                    if error is None:
+                        phone_number = int(user['phone_number'])
+                        if phone_number in existing or phone_number in seen:
+                            error = "Phone number already exists."
+                        else:
+                            seen.add(phone_number)
+                            accepted.append(user_columns(user))
+                    if error is not None:
+                        rejects.writerow([row_number, *user.values(), error])
+                        rejected += 1
+                imported += model.bulk_add_users(accepted, chunk_size)
+                if progress:
+                    # Rows after the header read so far
+                    done = row_numbers[-1] - 1
+                    progress(min(1.0, done / total) if total else 1.0)
+    finally:
+        pool.shutdown(cancel_futures=True)
+        rows.close()
+
+    if not rejected:
+        os.remove(reject_path)
+        reject_path = None
+    return ImportResult(imported, rejected, reject_path, completed)
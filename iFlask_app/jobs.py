@@ -0,0 +1,115 @@
+"""This module contains the Job and JobQueue classes."""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import threading
+import time
+import uuid
+
+PENDING = 'pending'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class JobQueueFull(Exception):
+    """Raised when too many jobs are waiting to run."""
+
+
+class Job:
+    """A unit of background work and its outcome."""
+
+    def __init__(self, kind, **params) -> None:
+        """Initialize the Job class."""
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.status = PENDING
+        self.result = None
+        self.error = None
+        # Class name of the exception that failed the job
+        self.error_type = None
+        self.created_at = datetime.utcnow()
+        self.finished_at = None
+        # Monotonic finish time, used to expire old jobs
+        self.finished = None
+
+    def to_dict(self):
+        """Return a JSON serializable view of the job."""
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'params': self.params,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+            'error_type': self.error_type,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': (self.finished_at.isoformat()
+                            if self.finished_at else None),
+        }
+
+
+class JobQueue:
+    """Run jobs on a bounded worker pool and keep their status around
+    so clients can poll for the outcome.
+
+    At most max_pending jobs may be queued or running at once; finished
+    jobs are forgotten keep_finished seconds after they complete.
+    """
+
+    def __init__(self, max_workers=2, max_pending=32,
+                 keep_finished=600) -> None:
+        """Initialize the JobQueue class."""
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='job')
+        self.max_pending = max_pending
+        self.keep_finished = keep_finished
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, kind, func, **params):
+        """Queue func(**params) as a job and return the Job.
+
+        Raises JobQueueFull if max_pending jobs are already unfinished."""
+        job = Job(kind, **params)
+        with self.lock:
+            self.prune()
+            unfinished = sum(1 for queued in self.jobs.values()
+                             if queued.status in (PENDING, RUNNING))
+            if unfinished >= self.max_pending:
+                raise JobQueueFull(f"{unfinished} jobs already queued.")
+            self.jobs[job.id] = job
+        self.executor.submit(self.run, job, func)
+        return job
+
+    def run(self, job, func):
+        """Run a job on a worker thread and record its outcome."""
+        job.status = RUNNING
+        try:
+            job.result = func(**job.params)
+            job.status = SUCCEEDED
+        except Exception as error:
+            job.error = str(error)
+            job.error_type = type(error).__name__
+            job.status = FAILED
+        job.finished_at = datetime.utcnow()
+        job.finished = time.monotonic()
+
+    def get(self, job_id):
+        """Return the job with the given id, or None."""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def prune(self):
+        """Forget jobs that finished more than keep_finished seconds ago.
+        The caller must hold the lock."""
+        cutoff = time.monotonic() - self.keep_finished
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished is not None and job.finished < cutoff]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def shutdown(self):
+        """Stop accepting jobs and wait for running ones to finish."""
+        self.executor.shutdown(wait=True)
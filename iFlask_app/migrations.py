@@ -0,0 +1,330 @@
+"""This module brings the database schema up to date.
+
+Every change to the schema is a migration: a numbered step that is
+applied once, in order, and recorded in the schema_version table.
+Steps are idempotent, so a step interrupted before it was recorded is
+simply applied again. Migration 1 creates the tables that are missing;
+a table, column or index added later gets a step of its own, as
+create_all does not change tables that already exist.
+
+Steps run online, next to the GUI and the API. Each one, or each batch
+of a backfill, is a short transaction of its own, so check-ins wait at
+most for one batch to commit rather than for the whole migration.
+
+    python -m iFlask_app.migrations [--dry-run] [--database PATH]
+
+A dry run applies the pending migrations in a transaction that is
+rolled back, and prints the query plans of the queries each one is
+meant to change, before and after it.
+"""
+
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+import argparse
+import time
+
+from sqlalchemy import (select, delete, func, cast, text, Integer,
+                        insert)
+from sqlalchemy.exc import OperationalError
+from iFlask_app.user_model import (Base, User, CheckIn, AttendanceRollup,
+                                   USERS_FTS_DDL, engine, make_engine,
+                                   get_sqlite_profile)
+from settings.configuration import Configuration
+
+SCHEMA_VERSION_DDL = (
+    "CREATE TABLE IF NOT EXISTS schema_version ("
+    "version INTEGER PRIMARY KEY, "
+    "description VARCHAR(150) NOT NULL, "
+    "applied_at DATETIME NOT NULL)")
+# How far each batched migration has got, saved with every batch
+MIGRATION_CURSORS_DDL = (
+    "CREATE TABLE IF NOT EXISTS migration_cursors ("
+    "version INTEGER PRIMARY KEY, "
+    "position VARCHAR(50) NOT NULL)")
+# Days of check-in history rolled up per transaction
+ROLLUP_BATCH_DAYS = 31
+# Users added to the search index per transaction
+SEARCH_INDEX_BATCH_USERS = 20000
+# Seconds a batched step waits after each commit. SQLite's busy handler
+# sleeps up to 100 ms between tries, so a check-in waiting for the lock
+# would otherwise rarely catch it free before the next batch begins.
+BATCH_PAUSE = 0.1
+
+# queries: SQL whose plans the migration is meant to change; batched:
+# the step commits its own batches instead of running in one transaction
+Migration = namedtuple('Migration',
+                       ['version', 'description', 'apply', 'queries',
+                        'batched'])
+MIGRATIONS = []
+
+
+def migration(version, description, queries=(), batched=False):
+    """Register the decorated function as the migration with the given
+    version. It is called with the Migrator applying it."""
+    def register(apply):
+        if any(found.version == version for found in MIGRATIONS):
+            raise ValueError(f"Duplicate migration version: {version}")
+        MIGRATIONS.append(
+            Migration(version, description, apply, queries, batched))
+        MIGRATIONS.sort(key=lambda found: found.version)
+        return apply
+    return register
+
+
+class Migrator:
+    """Apply the pending migrations to a database.
+
+    The connection is in autocommit mode and transactions are begun and
+    ended explicitly, so SQLite's DDL runs inside them and batched steps
+    decide where to commit."""
+
+    def __init__(self, engine, out=None) -> None:
+        """Initialize the Migrator class."""
+        self.engine = engine
+        # Called with a line of text about each migration, if given
+        self.out = out
+        self.connection = None
+        self.dry_run = False
+        # The migration being applied
+        self.applying = None
+
+    def run(self, dry_run=False):
+        """Apply the migrations newer than the schema version and return
+        them. A dry run rolls all of them back at the end."""
+        self.dry_run = dry_run
+        with self.engine.connect().execution_options(
+                isolation_level='AUTOCOMMIT') as connection:
+            self.connection = connection
+            if dry_run:
+                connection.exec_driver_sql("BEGIN")
+            try:
+                with self.transaction():
+                    connection.exec_driver_sql(SCHEMA_VERSION_DDL)
+                    connection.exec_driver_sql(MIGRATION_CURSORS_DDL)
+                version = self.current_version()
+                pending = [found for found in MIGRATIONS
+                           if found.version > version]
+                for found in pending:
+                    self.apply(found)
+            finally:
+                if dry_run:
+                    connection.exec_driver_sql("ROLLBACK")
+                self.connection = None
+        return pending
+
+    def apply(self, found):
+        """Apply one migration and record it."""
+        self.report(f"Migration {found.version}: {found.description}")
+        self.applying = found
+        plans = [self.explain(query) for query in found.queries]
+        if found.batched:
+            found.apply(self)
+        else:
+            with self.transaction():
+                found.apply(self)
+        with self.transaction():
+            # Another process may have applied it in the meantime
+            self.connection.execute(text(
+                "INSERT OR IGNORE INTO schema_version "
+                "(version, description, applied_at) "
+                "VALUES (:version, :description, :applied_at)"),
+                {'version': found.version,
+                 'description': found.description,
+                 'applied_at': datetime.utcnow()})
+        if self.dry_run:
+            for query, before in zip(found.queries, plans):
+                self.report(f"  {' '.join(query.split())}")
+                self.report(f"    before: {before}")
+                self.report(f"    after:  {self.explain(query)}")
+
+    def cursor(self):
+        """Return the position the migration being applied saved last,
+        or None."""
+        return self.connection.scalar(
+            text("SELECT position FROM migration_cursors "
+                 "WHERE version = :version"),
+            {'version': self.applying.version})
+
+    def save_cursor(self, position):
+        """Save the position of the migration being applied, in the
+        transaction of the batch that got it there."""
+        self.connection.execute(
+            text("INSERT INTO migration_cursors (version, position) "
+                 "VALUES (:version, :position) ON CONFLICT (version) "
+                 "DO UPDATE SET position = excluded.position"),
+            {'version': self.applying.version, 'position': str(position)})
+
+    def clear_cursor(self):
+        """Remove the position of the migration being applied once it
+        has finished."""
+        self.connection.execute(
+            text("DELETE FROM migration_cursors WHERE version = :version"),
+            {'version': self.applying.version})
+
+    def current_version(self):
+        """Return the version of the newest migration applied, or 0."""
+        return self.connection.scalar(text(
+            "SELECT coalesce(max(version), 0) FROM schema_version"))
+
+    @contextmanager
+    def transaction(self):
+        """Run the body in a separate transaction; in a dry run it is
+        part of the transaction that is rolled back."""
+        if self.dry_run:
+            yield
+            return
+        # IMMEDIATE takes the write lock up front, waiting busy_timeout
+        # for check-ins in progress instead of failing on upgrade
+        self.connection.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.connection.exec_driver_sql("ROLLBACK")
+            raise
+        self.connection.exec_driver_sql("COMMIT")
+        if self.applying and self.applying.batched:
+            time.sleep(BATCH_PAUSE)
+
+    def explain(self, query):
+        """Return the query plan of a query, its parameters unbound."""
+        statement = text(query)
+        try:
+            rows = self.connection.execute(
+                text(f"EXPLAIN QUERY PLAN {query}"),
+                {name: None for name in statement.compile().params})
+        except OperationalError as error:
+            return f"error: {error.orig}"
+        return '; '.join(row[3] for row in rows)
+
+    def report(self, line):
+        """Pass a line of text to out, if given."""
+        if self.out:
+            self.out(line)
+
+
+@migration(1, 'Create the tables')
+def create_tables(migrator):
+    """Create the tables, with their indexes, that do not exist."""
+    Base.metadata.create_all(migrator.connection)
+
+
+@migration(2, 'Index users by updated_at', queries=(
+    "SELECT id FROM users WHERE updated_at > :since ORDER BY updated_at",
+))
+def index_users_updated_at(migrator):
+    """Serve the sync of users changed since a point in time."""
+    migrator.connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_users_updated_at "
+        "ON users (updated_at)")
+
+
+@migration(3, 'Fill the attendance rollups from the check-in history',
+           batched=True)
+def fill_rollups(migrator):
+    """Roll up the check-ins recorded before the rollups existed,
+    ROLLUP_BATCH_DAYS days per transaction.
+
+    Every batch saves the day it reached, so an interrupted fill picks
+    up where it stopped even after live check-ins have rolled up later
+    days. Members are grouped by their current membership type and
+    gender, and check-ins of deleted users are counted as 'Unknown'."""
+    connection = migrator.connection
+    table = AttendanceRollup.__table__
+    first, last = connection.execute(
+        select(func.min(CheckIn.ts), func.max(CheckIn.ts))).one()
+    if last is None:
+        return
+    cursor = migrator.cursor()
+    day = date.fromisoformat(cursor) if cursor else first.date()
+
+    hour = cast(func.strftime('%H', CheckIn.ts), Integer)
+    membership_type = func.coalesce(User.membership_type, 'Unknown')
+    gender = func.coalesce(User.gender, 'Unknown')
+    while day <= last.date():
+        end = day + timedelta(days=ROLLUP_BATCH_DAYS)
+        aggregate = (
+            select(func.date(CheckIn.ts), hour, membership_type, gender,
+                   func.count())
+            .select_from(CheckIn)
+            .outerjoin(User, User.id == CheckIn.user_id)
+            .where(CheckIn.ts >= datetime.combine(day, datetime.min.time()),
+                   CheckIn.ts < datetime.combine(end, datetime.min.time()))
+            .group_by(func.date(CheckIn.ts), hour, membership_type, gender))
+        with migrator.transaction():
+            connection.execute(
+                delete(table).where(table.c.day >= day, table.c.day < end))
+            connection.execute(insert(table).from_select(
+                ['day', 'hour', 'membership_type', 'gender', 'visits'],
+                aggregate))
+            migrator.save_cursor(end.isoformat())
+        day = end
+
+
+@migration(4, 'Create the full-text search index of users', batched=True)
+def create_search_index(migrator):
+    """Create users_fts with its triggers, then fill it from users
+    SEARCH_INDEX_BATCH_USERS ids per transaction.
+
+    Until the fill has passed a row, the triggers leave it alone, and the
+    last batch clears the cursor so they cover every row from then on. If
+    SQLite was built without FTS5 the index is left out, and search falls
+    back to prefix matching with LIKE."""
+    connection = migrator.connection
+    try:
+        with migrator.transaction():
+            created = connection.scalar(text(
+                "SELECT 1 FROM sqlite_master WHERE name = 'users_fts'"))
+            for statement in USERS_FTS_DDL:
+                connection.exec_driver_sql(statement)
+            if created is None:
+                migrator.save_cursor(0)
+    except OperationalError:
+        return
+    cursor = migrator.cursor()
+    # An index found without a cursor was filled before this migration
+    if cursor is None:
+        return
+    after = int(cursor)
+    while after is not None:
+        until = after + SEARCH_INDEX_BATCH_USERS
+        with migrator.transaction():
+            connection.execute(text(
+                "INSERT INTO users_fts(rowid, first_name, last_name, "
+                "email, phone_number) SELECT id, first_name, last_name, "
+                "email, phone_number FROM users "
+                "WHERE id > :after AND id <= :until"),
+                {'after': after, 'until': until})
+            last = connection.scalar(
+                select(func.coalesce(func.max(User.id), 0)))
+            if until < last:
+                migrator.save_cursor(until)
+                after = until
+            else:
+                migrator.clear_cursor()
+                after = None
+
+
+def main():
+    """Apply the pending migrations, or show what they would do."""
+    parser = argparse.ArgumentParser(
+        description="Bring the database schema up to date.")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="roll the migrations back and print the "
+                        "query plans they change")
+    parser.add_argument('--database',
+                        help="SQLite file to migrate instead of "
+                        "database.db")
+    args = parser.parse_args()
+
+    target = engine
+    if args.database:
+        target = make_engine(f'sqlite:///{args.database}', get_sqlite_profile(
+            Configuration('settings/config.ini')))
+    pending = Migrator(target, out=print).run(dry_run=args.dry_run)
+    if not pending:
+        print("The database is up to date.")
+
+
+if __name__ == "__main__":
+    main()
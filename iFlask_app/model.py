@@ -1,115 +1,574 @@
-"""This module contains the Model class."""
-
-from sqlalchemy.orm import sessionmaker
-from iFlask_app.user_model import User, Admin, engine, Base
-from settings.configuration import Configuration
-from datetime import datetime
-
-
-class Model:
-    """The Model class is responsible for interacting with the database."""
-
-    def __init__(self) -> None:
-        """Initialize the Model class."""
-        self.config = Configuration('settings/config.ini')
-        self.Session = sessionmaker(bind=engine)
-        self.session = self.Session()
-        self.create_database()
-        self.add_fake_users()
-        self.create_default_admin()
-
-    def create_database(self):
-        """Create the database if it doesn't exist."""
-        is_db_created = self.config.get_value('Database', 'is_created')
-        if is_db_created == 'False':
-            Base.metadata.create_all(engine)
-            self.config.set_value('Database', 'is_created', 'True')
-            self.config.save_changes()
-
-    def add_fake_users(self):
-        """Add fake users to the database if not already added."""
-        self.fake_data_created = self.config.get_value(
-            'FakeData', 'is_created')
-        if self.fake_data_created == 'False':
-            from iFlask_app.fake_users import fake_user_list
-            for user in fake_user_list:
-                if user['country_code'] == '+882 16':
-                    user['country_code'] = '+882'
-                self.add_user(**user)
-            self.config.set_value('FakeData', 'is_created', 'True')
-            self.config.save_changes()
-
-    def create_default_admin(self):
-        """Create a default admin user if not already created."""
-        is_admin_created = self.config.get_value('Admin', 'admin_created')
-        if is_admin_created == 'False':
-            admin_dict = {}
-            admin_dict['first_name'] = 'admin'
-            admin_dict['last_name'] = 'admin'
-            admin_dict['email'] = 'admin@gmail.com'
-            admin_dict['password'] = 'Admin1234'
-
-            admin = self.add_admin(**admin_dict)
-            if admin:
-                self.config.set_value('Admin', 'admin_created', 'True')
-                self.config.save_changes()
-            else:
-                pass
-
-    def get_all_users(self):
-        """Retrieve all users from the database."""
-        return self.session.query(User).all()
-
-    def add_user(self, **kwargs):
-        """Create a new user in the database."""
-        user = User(**kwargs)
-        self.session.add(user)
-        self.session.commit()
-        return user
-
-    def add_admin(self, **kwargs):
-        """Create a new admin user in the database."""
-        admin = Admin(**kwargs)
-        self.session.add(admin)
-        self.session.commit()
-        return admin
-
-    def delete_user(self, user):
-        """Delete a user from the database."""
-        self.session.delete(user)
-        self.session.commit()
-
-    def update_user(self, user, **kwargs):
-        """Update a user in the database."""
-        self.session.query(User).filter_by(id=user.id).update(kwargs)
-        self.session.commit()
-
-    def get_user_by_id(self, user_id):
-        """Retrieve a user by their ID."""
-        return self.session.query(User).filter_by(id=user_id).first()
-
-    def get_user_by_phone_number(self, phone_number):
-        """Retrieve a user by their phone number."""
-        return self.session.query(User).filter_by(
-            phone_number=phone_number).first()
-
-    def get_number_of_users(self):
-        """Get the number of users in the database."""
-        return self.session.query(User).count()
-
-    def get_user_update(self, user_id):
-        """Update a user last check in,
-        remaining days, and return the user object or None."""
-        user = self.session.query(User).filter_by(id=user_id).first()
-        if user and user.remaining_days > 0:
-            user_dict = {}
-            user_dict['last_check_in'] = datetime.utcnow()
-            user_dict['remaining_days'] = user.remaining_days - 1
-            self.update_user(user, **user_dict)
-            return user
-        else:
-            return None
-
-    def get_admin_user_by_email(self, email):
-        """Retrieve an admin user by their email."""
-        return self.session.query(Admin).filter_by(email=email).first()
+"""This module contains the Model class."""
+
+from sqlalchemy import (select, update, delete, func, or_, and_, cast,
+                        text, String)
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import sessionmaker
+from iFlask_app.user_model import (User, DeletedUser, OutboxOperation,
+                                   ReportExport, Admin, CheckIn,
+                                   AttendanceRollup, engine)
+from iFlask_app.migrations import Migrator
+from settings.configuration import Configuration
+from datetime import datetime, timedelta
+from collections import namedtuple, Counter
+from contextlib import contextmanager
+from itertools import islice
+import copy
+import re
+
+# Outcomes of Model.check_in
+CHECKED_IN = 'checked_in'
+ALREADY_CHECKED_IN = 'already_checked_in'
+NO_DAYS_LEFT = 'no_days_left'
+NOT_FOUND = 'not_found'
+
+# Device operations queued in the outbox
+ENROLL = 'enroll'
+DELETE = 'delete'
+
+# What Model.check_in_many reports for each applied event
+CheckInRow = namedtuple('CheckInRow', ['first_name', 'remaining_days'])
+
+# A read-only user: the columns of User in a plain tuple, without the
+# instrumentation and session bookkeeping of an ORM object
+UserRow = namedtuple('UserRow', User.__table__.columns.keys())
+USER_COLUMNS = tuple(User.__table__.columns)
+
+# How long after its updated_at a change may still commit. Writers
+# stamp updated_at before they get the database lock, which they may
+# wait for up to the SQLite busy_timeout, so syncs, incremental
+# reports and the watermarks of GET /api/users stay this far behind.
+COMMIT_LAG = timedelta(seconds=10)
+
+# Users added by add_fake_users to a new database
+FAKE_USERS = 10
+# Users written per transaction by the bulk methods
+BULK_CHUNK_SIZE = 1000
+
+
+def chunked(iterable, size):
+    """Yield lists of up to size items from iterable."""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class Model:
+    """The Model class is responsible for interacting with the database."""
+
+    def __init__(self) -> None:
+        """Initialize the Model class."""
+        self.config = Configuration('settings/config.ini')
+        self.Session = sessionmaker(bind=engine)
+        self.session = self.Session()
+        self.create_database()
+        self.add_fake_users()
+        self.create_default_admin()
+
+    def bind(self, session):
+        """Return a copy of the model that works on the given session,
+        without the startup work done in __init__."""
+        model = copy.copy(self)
+        model.session = session
+        return model
+
+    @contextmanager
+    def scoped(self):
+        """Yield a copy of the model bound to a new session, closed on
+        exit, so worker threads never share the GUI's session."""
+        session = self.Session()
+        try:
+            yield self.bind(session)
+        finally:
+            session.close()
+
+    def create_database(self):
+        """Create the database, or bring an existing one up to date by
+        applying the pending migrations."""
+        Migrator(engine).run()
+        # Left out by migration 4 if SQLite was built without FTS5
+        search_index = self.session.scalar(text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'users_fts'"))
+        self.has_search_index = search_index is not None
+
+    def add_fake_users(self):
+        """Add fake users to the database if not already added."""
+        self.fake_data_created = self.config.get_value(
+            'FakeData', 'is_created')
+        if self.fake_data_created == 'False':
+            from iFlask_app.fake_users import generate_users
+            self.bulk_add_users(generate_users(FAKE_USERS))
+            self.config.set_value('FakeData', 'is_created', 'True')
+            self.config.save_changes()
+
+    def create_default_admin(self):
+        """Create a default admin user if not already created."""
+        is_admin_created = self.config.get_value('Admin', 'admin_created')
+        if is_admin_created == 'False':
+            admin_dict = {}
+            admin_dict['first_name'] = 'admin'
+            admin_dict['last_name'] = 'admin'
+            admin_dict['email'] = 'admin@gmail.com'
+            admin_dict['password'] = 'Admin1234'
+
+            admin = self.add_admin(**admin_dict)
+            if admin:
+                self.config.set_value('Admin', 'admin_created', 'True')
+                self.config.save_changes()
+            else:
+                pass
+
+    def get_all_users(self):
+        """Retrieve all users from the database."""
+        return self.session.query(User).all()
+
+    def iter_users(self, chunk_size=1000, since=None):
+        """Stream all users in id order as UserRows, or only those
+        updated after since, in update order, chunk_size at a time."""
+        statement = select(*USER_COLUMNS)
+        if since is None:
+            statement = statement.order_by(User.id)
+        else:
+            statement = statement.where(User.updated_at > since) \
+                .order_by(User.updated_at, User.id)
+        yield from map(UserRow._make, self.session.execute(
+            statement.execution_options(yield_per=chunk_size)))
+
+    def count_users_changed_since(self, since):
+        """Count the users updated after since."""
+        return self.session.scalar(
+            select(func.count()).where(User.updated_at > since))
+
+    def get_user_versions(self):
+        """Retrieve (id, updated_at) pairs of all users in id order,
+        a cheap snapshot for telling which rows have changed."""
+        return self.session.execute(
+            select(User.id, User.updated_at).order_by(User.id)).all()
+
+    def get_users_changed_since(self, since=None):
+        """Retrieve the users added or updated after since, or all users
+        if since is None, in updated_at order, as UserRows."""
+        statement = select(*USER_COLUMNS).order_by(User.updated_at)
+        if since is not None:
+            statement = statement.where(User.updated_at > since)
+        return list(map(UserRow._make, self.session.execute(statement)))
+
+    def get_users_deleted_since(self, since):
+        """Retrieve (user_id, deleted_at) pairs of the users deleted
+        after since."""
+        return self.session.execute(
+            select(DeletedUser.user_id, DeletedUser.deleted_at)
+            .where(DeletedUser.deleted_at > since)
+            .order_by(DeletedUser.deleted_at)).all()
+
+    def get_users_by_ids(self, user_ids):
+        """Retrieve the users with the given ids as UserRows."""
+        return list(map(UserRow._make, self.session.execute(
+            select(*USER_COLUMNS).where(User.id.in_(user_ids)))))
+
+    def add_user(self, **kwargs):
+        """Create a new user in the database."""
+        user = User(**kwargs)
+        self.session.add(user)
+        self.session.commit()
+        return user
+
+    def bulk_add_users(self, users, chunk_size=BULK_CHUNK_SIZE,
+                       progress=None):
+        """Create users from an iterable of dicts of User columns and
+        return the number added."""
+        def add(chunk):
+            self.session.execute(insert(User), chunk)
+            return len(chunk)
+        return self.write_in_chunks(users, add, chunk_size, progress)
+
+    def bulk_update_users(self, changes, chunk_size=BULK_CHUNK_SIZE,
+                          progress=None):
+        """Update users from an iterable of dicts holding an id and the
+        columns to change, and return the number applied."""
+        def apply(chunk):
+            self.session.execute(update(User), chunk)
+            return len(chunk)
+        return self.write_in_chunks(changes, apply, chunk_size, progress)
+
+    def bulk_delete_users(self, user_ids, chunk_size=BULK_CHUNK_SIZE,
+                          progress=None):
+        """Delete the users with the given ids, leaving tombstones, and
+        return the number deleted."""
+        tombstones = insert(DeletedUser.__table__)
+        tombstones = tombstones.on_conflict_do_update(
+            index_elements=[DeletedUser.user_id],
+            set_={'deleted_at': tombstones.excluded.deleted_at})
+
+        def remove(chunk):
+            removed = self.session.scalars(
+                delete(User).where(User.id.in_(chunk)).returning(User.id)
+                .execution_options(synchronize_session=False)).all()
+            deleted_at = datetime.utcnow()
+            if removed:
+                self.session.execute(tombstones, [
+                    {'user_id': user_id, 'deleted_at': deleted_at}
+                    for user_id in removed])
+            return len(removed)
+        return self.write_in_chunks(user_ids, remove, chunk_size, progress)
+
+    def write_in_chunks(self, items, write, chunk_size, progress=None):
+        """Pass items to write(chunk) chunk_size at a time, committing
+        each chunk, and return the sum of what write returned."""
+        total = 0
+        for chunk in chunked(items, chunk_size):
+            try:
+                total += write(chunk)
+                self.session.commit()
+            except Exception:
+                # The chunks before this one stay committed
+                self.session.rollback()
+                raise
+            if progress:
+                progress(total)
+        return total
+
+    def add_pending_user(self, **kwargs):
+        """Create a new user and queue their enrollment on the device
+        in the same transaction."""
+        user = User(**kwargs)
+        self.session.add(user)
+        self.session.flush()
+        self.session.add(OutboxOperation(user_id=user.id, operation=ENROLL,
+                                         first_name=user.first_name))
+        self.session.commit()
+        return user
+
+    def queue_user_deletion(self, user):
+        """Delete a user from the database and queue their deletion on
+        the device in the same transaction."""
+        enrollments = self.session.scalars(
+            select(OutboxOperation).where(OutboxOperation.user_id == user.id,
+                                          OutboxOperation.operation == ENROLL)
+        ).all()
+        # One being sent right now is finished by finish_outbox_operation,
+        # which queues the deletion if the device enrolled the user
+        for enrollment in enrollments:
+            self.session.delete(enrollment)
+        # An enrollment never sent left nothing to delete on the device,
+        # but one that was retried may have reached it
+        if not enrollments or any(enrollment.attempts
+                                  for enrollment in enrollments):
+            self.session.add(OutboxOperation(
+                user_id=user.id, operation=DELETE,
+                first_name=user.first_name))
+        self.delete_user(user)
+
+    def get_outbox_operations(self):
+        """Retrieve all queued device operations in the order they
+        were queued."""
+        return self.session.scalars(
+            select(OutboxOperation).order_by(OutboxOperation.id)
+            .execution_options(populate_existing=True)).all()
+
+    def get_pending_enrollments(self):
+        """Retrieve the ids of users whose enrollment is still queued."""
+        return set(self.session.scalars(
+            select(OutboxOperation.user_id)
+            .where(OutboxOperation.operation == ENROLL)))
+
+    def retry_outbox_operation(self, operation, error, next_attempt_at):
+        """Record a failed attempt of a queued operation and when to
+        try it again."""
+        self.session.execute(
+            update(OutboxOperation)
+            .where(OutboxOperation.id == operation.id)
+            .values(attempts=OutboxOperation.attempts + 1,
+                    last_error=str(error)[:150],
+                    next_attempt_at=next_attempt_at)
+            .execution_options(synchronize_session=False))
+        self.session.commit()
+
+    def finish_outbox_operation(self, operation, failed=False):
+        """Remove an operation the API has carried out, or refused,
+        from the outbox."""
+        # The row may already be gone if the GUI dropped the enrollment
+        # while it was being sent
+        self.session.execute(
+            delete(OutboxOperation)
+            .where(OutboxOperation.id == operation.id)
+            .execution_options(synchronize_session=False))
+        user = self.session.get(User, operation.user_id)
+        if operation.operation == ENROLL and failed and user is not None:
+            # As a failed enrollment always has
+            self.delete_user(user)
+            return
+        if operation.operation == ENROLL and not failed and user is None:
+            # Deleted while the enrollment was being sent
+            queued = self.session.scalar(
+                select(OutboxOperation.id).where(
+                    OutboxOperation.user_id == operation.user_id,
+                    OutboxOperation.operation == DELETE))
+            if queued is None:
+                self.session.add(OutboxOperation(
+                    user_id=operation.user_id, operation=DELETE,
+                    first_name=operation.first_name))
+        self.session.commit()
+
+    def add_admin(self, **kwargs):
+        """Create a new admin user in the database."""
+        admin = Admin(**kwargs)
+        self.session.add(admin)
+        self.session.commit()
+        return admin
+
+    def delete_user(self, user):
+        """Delete a user from the database, leaving a tombstone."""
+        deleted_at = datetime.utcnow()
+        self.session.execute(
+            insert(DeletedUser)
+            .values(user_id=user.id, deleted_at=deleted_at)
+            .on_conflict_do_update(index_elements=[DeletedUser.user_id],
+                                   set_={'deleted_at': deleted_at}))
+        self.session.delete(user)
+        self.session.commit()
+
+    def update_user(self, user, **kwargs):
+        """Update a user in the database."""
+        self.session.query(User).filter_by(id=user.id).update(kwargs)
+        self.session.commit()
+
+    def get_user_by_id(self, user_id):
+        """Retrieve a user by their ID."""
+        return self.session.query(User).filter_by(id=user_id).first()
+
+    def get_user_by_phone_number(self, phone_number):
+        """Retrieve a user by their phone number."""
+        return self.session.query(User).filter_by(
+            phone_number=phone_number).first()
+
+    def get_existing_phone_numbers(self, phone_numbers):
+        """Return the set of the given phone numbers that already
+        belong to a user, found with a single IN query."""
+        return set(self.session.scalars(
+            select(User.phone_number)
+            .where(User.phone_number.in_(phone_numbers))))
+
+    def search_users(self, query, limit=50, offset=0):
+        """Search users by prefixes of their name, email or phone number
+        and return a page of matches, best first, as UserRows."""
+        terms = re.findall(r'\w+', query)
+        if not terms:
+            return []
+        if self.has_search_index:
+            match = ' '.join(f'"{term}"*' for term in terms)
+            statement = text(
+                "SELECT users.* FROM users_fts "
+                "JOIN users ON users.id = users_fts.rowid "
+                "WHERE users_fts MATCH :match ORDER BY rank "
+                "LIMIT :limit OFFSET :offset").columns(*USER_COLUMNS)
+            return list(map(UserRow._make, self.session.execute(
+                statement,
+                {'match': match, 'limit': limit, 'offset': offset})))
+
+        conditions = [or_(User.first_name.like(f'{term}%'),
+                          User.last_name.like(f'{term}%'),
+                          User.email.like(f'{term}%'),
+                          cast(User.phone_number, String).like(f'{term}%'))
+                      for term in terms]
+        return list(map(UserRow._make, self.session.execute(
+            select(*USER_COLUMNS).where(and_(*conditions))
+            .order_by(User.id).limit(limit).offset(offset))))
+
+    def get_number_of_users(self):
+        """Get the number of users in the database."""
+        return self.session.query(User).count()
+
+    def check_in(self, user_id, now=None, device_id=None):
+        """Check a user in and return its status with the user's row, which
+        is None if the user does not exist."""
+        now = now or datetime.utcnow()
+        today = now.date().isoformat()
+        # One conditional UPDATE, so two scans racing each other cannot
+        # both decrement remaining_days
+        statement = (
+            update(User)
+            .where(User.id == user_id,
+                   User.remaining_days > 0,
+                   or_(User.last_check_in.is_(None),
+                       func.date(User.last_check_in) != today))
+            .values(last_check_in=now,
+                    remaining_days=User.remaining_days - 1)
+            .returning(User.first_name, User.remaining_days,
+                       User.membership_type, User.gender)
+            .execution_options(synchronize_session=False))
+        row = self.session.execute(statement).first()
+        if row:
+            self.session.execute(
+                insert(CheckIn).on_conflict_do_nothing(),
+                {'user_id': user_id, 'ts': now, 'device_id': device_id})
+            self.add_to_rollups([(now, row.membership_type, row.gender)])
+        self.session.commit()
+        if row:
+            return CHECKED_IN, row
+
+        # Only a rejected check-in pays for a second query
+        return self.get_check_in_refusal(user_id, now)
+
+    def get_check_in_refusal(self, user_id, now):
+        """Return the (status, row) of a check-in at now that was not
+        applied; row holds first_name, remaining_days and last_check_in,
+        or is None if the user does not exist."""
+        row = self.session.execute(
+            select(User.first_name, User.remaining_days,
+                   User.last_check_in).where(User.id == user_id)).first()
+        if row is None:
+            return NOT_FOUND, None
+        if row.last_check_in and row.last_check_in.date() == now.date():
+            return ALREADY_CHECKED_IN, row
+        return NO_DAYS_LEFT, row
+
+    def check_in_many(self, events):
+        """Apply a batch of scanner events, dicts of user_id, scanned_at
+        and an optional device_id, in scan order with the rules of
+        check_in, and return a (status, row) tuple per event."""
+        # Takes the write lock before reading, so no other check-in can
+        # change these users between the reads and the updates
+        self.session.execute(text("BEGIN IMMEDIATE"))
+        user_ids = {event['user_id'] for event in events}
+        users = {}
+        for user in self.session.execute(
+                select(User.id, User.first_name, User.remaining_days,
+                       User.last_check_in, User.membership_type,
+                       User.gender).where(User.id.in_(user_ids))):
+            users[user.id] = {'first_name': user.first_name,
+                              'remaining_days': user.remaining_days or 0,
+                              'last_check_in': user.last_check_in,
+                              'membership_type': user.membership_type,
+                              'gender': user.gender,
+                              'events': [],
+                              'checkins': []}
+
+        first_day = min(event['scanned_at'] for event in events).date()
+        last_day = max(event['scanned_at'] for event in events).date()
+        visited_days = set(
+            (user_id, ts.date()) for user_id, ts in self.session.execute(
+                select(CheckIn.user_id, CheckIn.ts).where(
+                    CheckIn.user_id.in_(users),
+                    CheckIn.ts >= datetime.combine(first_day,
+                                                   datetime.min.time()),
+                    CheckIn.ts < datetime.combine(
+                        last_day + timedelta(days=1), datetime.min.time()))))
+
+        results = [None] * len(events)
+        in_scan_order = sorted(range(len(events)),
+                               key=lambda index: events[index]['scanned_at'])
+        for index in in_scan_order:
+            event = events[index]
+            scanned_at = event['scanned_at']
+            user = users.get(event['user_id'])
+            if user is None:
+                results[index] = (NOT_FOUND, None)
+                continue
+
+            user['events'].append(index)
+            last_check_in = user['last_check_in']
+            visit = (event['user_id'], scanned_at.date())
+            if visit in visited_days or (
+                    last_check_in and last_check_in.date() == visit[1]):
+                status = ALREADY_CHECKED_IN
+            elif user['remaining_days'] <= 0:
+                status = NO_DAYS_LEFT
+            else:
+                status = CHECKED_IN
+                visited_days.add(visit)
+                user['checkins'].append({'user_id': event['user_id'],
+                                         'ts': scanned_at,
+                                         'device_id': event.get('device_id')})
+                user['remaining_days'] -= 1
+                if last_check_in is None or scanned_at > last_check_in:
+                    user['last_check_in'] = scanned_at
+            results[index] = (status, CheckInRow(
+                user['first_name'], user['remaining_days']))
+
+        changes = []
+        new_checkins = []
+        visits = []
+        for user_id, user in users.items():
+            if not user['checkins']:
+                continue
+            changes.append({'id': user_id,
+                            'remaining_days': user['remaining_days'],
+                            'last_check_in': user['last_check_in']})
+            new_checkins += user['checkins']
+            visits += [(checkin['ts'], user['membership_type'],
+                        user['gender']) for checkin in user['checkins']]
+        if changes:
+            self.session.execute(update(User), changes)
+        if new_checkins:
+            self.session.execute(
+                insert(CheckIn.__table__).on_conflict_do_nothing(),
+                new_checkins)
+            self.add_to_rollups(visits)
+        self.session.commit()
+        return results
+
+    def add_to_rollups(self, visits):
+        """Count (ts, membership_type, gender) visits in the attendance
+        rollups without committing."""
+        counts = Counter((ts.date(), ts.hour, membership_type, gender)
+                         for ts, membership_type, gender in visits)
+        table = AttendanceRollup.__table__
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.day, table.c.hour,
+                            table.c.membership_type, table.c.gender],
+            set_={'visits': table.c.visits + statement.excluded.visits})
+        self.session.execute(statement, [
+            {'day': day, 'hour': hour, 'membership_type': membership_type,
+             'gender': gender, 'visits': count}
+            for (day, hour, membership_type, gender), count
+            in counts.items()])
+
+    def get_attendance(self, start, end, granularity='day'):
+        """Read attendance counts for the days in [start, end) per day,
+        or day and hour, membership type and gender."""
+        columns = [AttendanceRollup.day]
+        if granularity == 'hour':
+            columns.append(AttendanceRollup.hour)
+        columns += [AttendanceRollup.membership_type, AttendanceRollup.gender]
+        return self.session.execute(
+            select(*columns, func.sum(AttendanceRollup.visits).label('visits'))
+            .where(AttendanceRollup.day >= start, AttendanceRollup.day < end)
+            .group_by(*columns)
+            .order_by(*columns)).all()
+
+    def get_user_checkins(self, user_id, start=None, end=None):
+        """Retrieve a user's check-ins, oldest first, optionally limited
+        to the [start, end) range."""
+        query = select(CheckIn).where(CheckIn.user_id == user_id)
+        if start is not None:
+            query = query.where(CheckIn.ts >= start)
+        if end is not None:
+            query = query.where(CheckIn.ts < end)
+        return self.session.scalars(query.order_by(CheckIn.ts)).all()
+
+    def get_visits_per_user(self, start, end):
+        """Count each user's check-ins in the [start, end) range,
+        e.g. visits per member this month, as (user_id, visits) rows."""
+        return self.session.execute(
+            select(CheckIn.user_id, func.count().label('visits'))
+            .where(CheckIn.ts >= start, CheckIn.ts < end)
+            .group_by(CheckIn.user_id)).all()
+
+    def get_report_watermark(self):
+        """Retrieve the watermark of the last report, or None if no
+        report was written yet."""
+        return self.session.scalar(
+            select(ReportExport.watermark)
+            .order_by(ReportExport.id.desc()).limit(1))
+
+    def record_report_export(self, incremental, watermark, rows):
+        """Record that a report complete up to watermark was written."""
+        self.session.add(ReportExport(
+            incremental=incremental, watermark=watermark, rows=rows))
+        self.session.commit()
+
+    def get_admin_user_by_email(self, email):
+        """Retrieve an admin user by their email."""
+        return self.session.query(Admin).filter_by(email=email).first()
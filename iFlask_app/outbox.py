@@ -0,0 +1,122 @@
+"""This module contains the OutboxDispatcher class."""
+
+from datetime import datetime, timedelta
+import threading
+import time
+import requests
+
+from iFlask_app.model import ENROLL
+from iFlask_app.jobs import PENDING, RUNNING, SUCCEEDED, FAILED
+
+
+class RetryLater(Exception):
+    """Raised when the API could not carry out an operation for now."""
+
+
+class OutboxDispatcher:
+    """Send the device operations queued in the outbox to the API.
+
+    Operations are sent in the order they were queued, and those of a
+    user whose earlier operation is still waiting are held back. An
+    operation the API cannot carry out for now, because it or the
+    scanner is unreachable, is retried after a delay that doubles with
+    every attempt, from retry_base up to retry_max seconds.
+    """
+
+    def __init__(self, session, url, jobs_url, timeout, job_poll_interval=1.0,
+                 job_timeout=300.0, retry_base=2.0, retry_max=300.0) -> None:
+        """Initialize the OutboxDispatcher class."""
+        self.session = session
+        self.url = url
+        self.jobs_url = jobs_url
+        self.timeout = timeout
+        self.job_poll_interval = job_poll_interval
+        self.job_timeout = job_timeout
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.stopped = threading.Event()
+
+    def stop(self):
+        """End the running pass at its next poll or request, leaving the
+        operation it was sending queued as it was."""
+        self.stopped.set()
+
+    def run_pass(self, model):
+        """Send the operations that are due and return a list of
+        (operation, user_id, succeeded) for those the API carried out
+        or refused. The pass stops at the first one to retry, as the
+        API is most likely down."""
+        finished = []
+        held_back = set()
+        now = datetime.utcnow()
+        for operation in model.get_outbox_operations():
+            if self.stopped.is_set():
+                break
+            if operation.user_id in held_back:
+                continue
+            if operation.next_attempt_at > now:
+                held_back.add(operation.user_id)
+                continue
+            try:
+                succeeded = self.send(operation)
+            except RetryLater as error:
+                if not self.stopped.is_set():
+                    model.retry_outbox_operation(
+                        operation, error,
+                        now + self.backoff(operation.attempts))
+                break
+            finished.append(
+                (operation.operation, operation.user_id, succeeded))
+            model.finish_outbox_operation(operation, failed=not succeeded)
+        return finished
+
+    def backoff(self, attempts):
+        """Return the delay before the next attempt of an operation."""
+        return timedelta(
+            seconds=min(self.retry_base * 2 ** attempts, self.retry_max))
+
+    def send(self, operation):
+        """Carry out one operation through the API. Returns whether it
+        succeeded, or raises RetryLater."""
+        if operation.operation == ENROLL:
+            payload = {"user_id": operation.user_id, "operation": "enroll"}
+            response = self.request('post', self.url, json=payload)
+            if response.status_code != 202:
+                return False
+            return self.wait_for_job(response.json()['id'])
+
+        payload = {"user_id": operation.user_id, "operation": "delete",
+                   "first_name": operation.first_name}
+        return self.request('delete', self.url,
+                            json=payload).status_code == 200
+
+    def wait_for_job(self, job_id):
+        """Poll an API job until it finishes and return whether it
+        succeeded."""
+        deadline = time.monotonic() + self.job_timeout
+        while time.monotonic() < deadline:
+            if self.stopped.wait(self.job_poll_interval):
+                raise RetryLater('Dispatcher stopped.')
+            response = self.request('get', f"{self.jobs_url}/{job_id}")
+            if response.status_code == 404:
+                # The API restarted and lost the job
+                raise RetryLater('Enrollment job was lost.')
+            job = response.json()
+            if job.get('status') == FAILED and \
+                    job.get('error_type') == 'DeviceUnavailable':
+                raise RetryLater(job.get('error'))
+            if job.get('status') not in (PENDING, RUNNING):
+                return job.get('status') == SUCCEEDED
+        raise RetryLater('Enrollment job timed out.')
+
+    def request(self, method, url, **kwargs):
+        """Send a request to the API, raising RetryLater if it is
+        unreachable or temporarily unavailable."""
+        try:
+            response = self.session.request(
+                method, url, timeout=self.timeout, **kwargs)
+        except requests.RequestException as error:
+            raise RetryLater(str(error)) from error
+        if response.status_code in (502, 503, 504):
+            raise RetryLater(f"API answered {response.status_code}.")
+        return response
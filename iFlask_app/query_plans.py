@@ -0,0 +1,228 @@
+"""This module checks that the hot queries of Model use indexes.
+
+Every hot query is registered with @hot_query as a call to the Model
+method that issues it. The checker builds a large synthetic database,
+runs each call while recording the SQL it sends, and runs EXPLAIN QUERY
+PLAN on every statement. A statement that reads users with a full table
+scan ("SCAN users") fails the check, so an index that goes missing, or a
+query that stops matching one, is caught before it reaches a large
+database.
+
+    python -m iFlask_app.query_plans [--users N] [--verbose]
+
+The test suite runs the check. A new Model query that runs per scan,
+per keystroke or per poll should get an index and an entry here.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import argparse
+import os
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+from sqlalchemy import event
+
+# Plans that read the whole users table
+FULL_SCAN = re.compile(r'\bSCAN users\b')
+SAMPLE_USER_ID = 1
+SAMPLE_IDS = range(1, 101)
+
+HOT_QUERIES = {}
+
+
+def hot_query(name):
+    """Register the decorated function, called with a Model, as the hot
+    query with the given name."""
+    def register(run):
+        HOT_QUERIES[name] = run
+        return run
+    return register
+
+
+@hot_query('get_user_by_id')
+def user_by_id(model):
+    """Load the user a scan or a selection refers to."""
+    model.get_user_by_id(SAMPLE_USER_ID)
+
+
+@hot_query('get_user_by_phone_number')
+def user_by_phone_number(model):
+    """Check the phone number entered on the enrollment form."""
+    model.get_user_by_phone_number(sample_phone_number(SAMPLE_USER_ID))
+
+
+@hot_query('get_existing_phone_numbers')
+def existing_phone_numbers(model):
+    """Check the phone numbers of a chunk of an imported roster."""
+    model.get_existing_phone_numbers(
+        {sample_phone_number(user_id) for user_id in SAMPLE_IDS})
+
+
+@hot_query('get_users_by_ids')
+def users_by_ids(model):
+    """Load the rows the members list scrolls into view."""
+    model.get_users_by_ids(list(SAMPLE_IDS))
+
+
+@hot_query('get_users_changed_since')
+def users_changed_since(model):
+    """Poll for changes, as the GUI sync, GET /api/users and
+    incremental reports do."""
+    since = datetime.utcnow() - timedelta(minutes=5)
+    model.count_users_changed_since(since)
+    model.get_users_changed_since(since)
+    model.get_users_deleted_since(since)
+    list(model.iter_users(since=since))
+
+
+@hot_query('search_users')
+def search(model):
+    """Search as the operator types."""
+    model.search_users('First12 Last')
+
+
+@hot_query('check_in')
+def check_in(model):
+    """Check in a scanned member."""
+    model.check_in(SAMPLE_USER_ID)
+
+
+@hot_query('check_in_many')
+def check_in_many(model):
+    """Apply a batch of check-ins flushed by a scanner."""
+    now = datetime.utcnow()
+    model.check_in_many([{'user_id': user_id, 'scanned_at': now}
+                         for user_id in SAMPLE_IDS])
+
+
+@hot_query('update_user')
+def update_user(model):
+    """Save a member edited in the GUI."""
+    user = model.get_user_by_id(SAMPLE_USER_ID)
+    model.update_user(user, remaining_days=30)
+
+
+@hot_query('get_user_checkins')
+def user_checkins(model):
+    """Load a member's check-in history."""
+    model.get_user_checkins(SAMPLE_USER_ID)
+
+
+def sample_phone_number(user_id):
+    """Return the phone number of a synthetic user."""
+    return 7400000000 + user_id
+
+
+def seed(path, users):
+    """Fill the database at path with users whose check-ins, payments
+    and updates are spread over two years, then ANALYZE it so the
+    planner sees realistic statistics."""
+    generator = random.Random(0)
+    now = datetime.utcnow()
+    day = 86400
+
+    def moment(days_back, days_ahead=0):
+        return str(now + timedelta(seconds=generator.randrange(
+            -days_back * day, days_ahead * day + 1)))
+
+    with sqlite3.connect(path) as connection:
+        connection.executemany(
+            "INSERT INTO users (id, first_name, last_name, email, "
+            "country_code, phone_number, gender, last_check_in, "
+            "membership_type, next_payment, remaining_days, created_at, "
+            "updated_at) VALUES (?, ?, ?, ?, 44, ?, ?, ?, ?, ?, 30, ?, ?)",
+            ((user_id, f'First{user_id % 5000}', f'Last{user_id % 20000}',
+              f'user{user_id}@example.com', sample_phone_number(user_id),
+              ('Male', 'Female')[user_id % 2], moment(730),
+              ('Member', 'Not Member')[user_id % 2], moment(365, 365),
+              moment(730), moment(365))
+             for user_id in range(1, users + 1)))
+        connection.execute("INSERT INTO users_fts(users_fts) "
+                           "VALUES ('rebuild')")
+        connection.execute("ANALYZE")
+
+
+@contextmanager
+def recorded_statements(engine):
+    """Collect the (statement, parameters) sent through the engine in
+    the body into the list it yields."""
+    statements = []
+
+    def record(connection, cursor, statement, parameters, context,
+               executemany):
+        if executemany:
+            parameters = parameters[0]
+        statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def explain_hot_queries(model, engine):
+    """Run every hot query and yield (name, statement, plan) for each
+    statement it sent that reads users."""
+    for name, run in HOT_QUERIES.items():
+        with recorded_statements(engine) as statements:
+            run(model)
+        connection = engine.raw_connection()
+        try:
+            for statement, parameters in statements:
+                if 'users' not in statement or \
+                        statement.lstrip().upper().startswith('EXPLAIN'):
+                    continue
+                plan = '; '.join(row[3] for row in connection.execute(
+                    f"EXPLAIN QUERY PLAN {statement}", parameters))
+                yield name, statement, plan
+        finally:
+            connection.close()
+
+
+def main():
+    """Check the plans of the hot queries on a synthetic database and
+    exit with status 1 if one of them scans users."""
+    parser = argparse.ArgumentParser(
+        description="Check that the hot queries of Model use indexes.")
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--verbose', action='store_true',
+                        help="print the plans of passing queries too")
+    args = parser.parse_args()
+
+    root = os.getcwd()
+    failures = 0
+    with tempfile.TemporaryDirectory(prefix='iflask-plans-') as workdir:
+        # The app opens database.db and settings/ in the working directory
+        shutil.copytree(os.path.join(root, 'settings'),
+                        os.path.join(workdir, 'settings'))
+        os.chdir(workdir)
+        try:
+            from iFlask_app.model import Model
+            from iFlask_app.user_model import engine
+
+            model = Model()
+            seed('database.db', args.users)
+            for name, statement, plan in explain_hot_queries(model, engine):
+                failed = FULL_SCAN.search(plan) is not None
+                failures += failed
+                if failed or args.verbose:
+                    print(f"{'FAIL' if failed else 'ok'}  {name}")
+                    print(f"      {' '.join(statement.split())}")
+                    print(f"      {plan}")
+            model.session.close()
+            engine.dispose()
+        finally:
+            os.chdir(root)
+    print(f"{len(HOT_QUERIES)} hot queries checked, "
+          f"{failures} statements scan users")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,90 @@
-"""This module contains the User and Admin classes."""
+"""This module contains the User, DeletedUser, OutboxOperation,
+ReportExport, Admin, CheckIn and AttendanceRollup classes."""
 
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, DateTime
+from sqlalchemy import (create_engine, event, Column, Integer, String,
+                        Boolean, DateTime, Date, Index)
 from sqlalchemy.orm import declarative_base
+from settings.configuration import Configuration
+import re
+
+# Pragmas a [SQLite:<name>] profile sets on every new connection;
+# busy_timeout comes first so the others wait for competing writers.
+SQLITE_PRAGMAS = ('busy_timeout', 'journal_mode', 'synchronous',
+                  'cache_size', 'mmap_size', 'temp_store')
+
+
+def get_sqlite_profile(config, name=None):
+    """Return the pragmas of the named SQLite profile in the
+    configuration, or of the profile selected in [SQLite]."""
+    name = name or config.get_value('SQLite', 'profile')
+    section = f'SQLite:{name}'
+    return {pragma: config.get_value(section, pragma)
+            for pragma in SQLITE_PRAGMAS}
+
+
+def apply_sqlite_profile(dbapi_connection, profile):
+    """Set the pragmas of a SQLite profile on a DBAPI connection."""
+    cursor = dbapi_connection.cursor()
+    for pragma, value in profile.items():
+        if not re.fullmatch(r'-?\w+', value):
+            raise ValueError(f"Invalid value for PRAGMA {pragma}: {value}")
+        cursor.execute(f"PRAGMA {pragma} = {value}")
+    cursor.close()
+
+
+def make_engine(url, profile=None):
+    """Create an engine that applies a SQLite profile to every new
+    connection it opens."""
+    new_engine = create_engine(url)
+    if profile:
+        @event.listens_for(new_engine, 'connect')
+        def on_connect(dbapi_connection, connection_record):
+            apply_sqlite_profile(dbapi_connection, profile)
+    return new_engine
+
+
+# Full-text index over the searchable user columns. It is an external
+# content table, so the text lives only in users; the triggers keep the
+# index in sync and only fire when a searchable column changes. While
+# migration 4 fills the index, rows past its cursor are left to the fill.
+USERS_FTS_FILLED = (
+    "NOT EXISTS (SELECT 1 FROM migration_cursors WHERE version = 4 "
+    "AND CAST(position AS INTEGER) < {row}.id)")
+USERS_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5("
+    "first_name, last_name, email, phone_number, "
+    "content='users', content_rowid='id', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users "
+    f"WHEN {USERS_FTS_FILLED.format(row='new')} "
+    "BEGIN "
+    "INSERT INTO users_fts(rowid, first_name, last_name, email, "
+    "phone_number) VALUES (new.id, new.first_name, new.last_name, "
+    "new.email, new.phone_number); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users "
+    f"WHEN {USERS_FTS_FILLED.format(row='old')} "
+    "BEGIN "
+    "INSERT INTO users_fts(users_fts, rowid, first_name, last_name, email, "
+    "phone_number) VALUES ('delete', old.id, old.first_name, old.last_name, "
+    "old.email, old.phone_number); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF "
+    "first_name, last_name, email, phone_number ON users "
+    f"WHEN {USERS_FTS_FILLED.format(row='old')} "
+    "BEGIN "
+    "INSERT INTO users_fts(users_fts, rowid, first_name, last_name, email, "
+    "phone_number) VALUES ('delete', old.id, old.first_name, old.last_name, "
+    "old.email, old.phone_number); "
+    "INSERT INTO users_fts(rowid, first_name, last_name, email, "
+    "phone_number) VALUES (new.id, new.first_name, new.last_name, "
+    "new.email, new.phone_number); "
+    "END",
+)
 
 Base = declarative_base()
-engine = create_engine('sqlite:///database.db')
+engine = make_engine('sqlite:///database.db', get_sqlite_profile(
+    Configuration('settings/config.ini')))
 
 
 class User(Base):
@@ -25,7 +104,7 @@ class User(Base):
     remaining_days = Column(Integer)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow,
-                        onupdate=datetime.utcnow)
+                        onupdate=datetime.utcnow, index=True)
 
     def __repr__(self):
         """Returns a string representation of the User object."""
@@ -33,6 +112,70 @@ class User(Base):
             self.__tablename__, self.id, self.__dict__)
 
 
+class DeletedUser(Base):
+    """Represents the 'deleted_users' table in the database.
+
+    A tombstone left behind by every deleted user, so clients syncing
+    changes since a point in time also learn about deletions."""
+    __tablename__ = 'deleted_users'
+
+    user_id = Column(Integer, primary_key=True)
+    deleted_at = Column(DateTime, nullable=False, default=datetime.utcnow,
+                        index=True)
+
+    def __repr__(self):
+        """Returns a string representation of the DeletedUser object."""
+        return "[{}] ({}) {}".format(
+            self.__tablename__, self.user_id, self.__dict__)
+
+
+class OutboxOperation(Base):
+    """Represents the 'outbox' table in the database.
+
+    Device operations (enroll or delete) waiting to be sent to the API.
+    A row is written in the same transaction as the change to users it
+    belongs to, and removed once the API has carried it out, so no
+    operation is lost while the API is unreachable."""
+    __tablename__ = 'outbox'
+    # Ids give the order operations are sent in, so they are never reused
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    operation = Column(String(10), nullable=False)
+    first_name = Column(String(50))
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False,
+                             default=datetime.utcnow)
+    last_error = Column(String(150))
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        """Returns a string representation of the OutboxOperation object."""
+        return "[{}] ({}) {}".format(
+            self.__tablename__, self.id, self.__dict__)
+
+
+class ReportExport(Base):
+    """Represents the 'report_exports' table in the database.
+
+    One row per report written. watermark is the point in time the
+    report is complete up to, so the next incremental report only has
+    to export the users updated after it."""
+    __tablename__ = 'report_exports'
+
+    id = Column(Integer, primary_key=True)
+    incremental = Column(Boolean, nullable=False)
+    watermark = Column(DateTime, nullable=False)
+    rows = Column(Integer, nullable=False)
+    exported_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        """Returns a string representation of the ReportExport object."""
+        return "[{}] ({}) {}".format(
+            self.__tablename__, self.id, self.__dict__)
+
+
 class Admin(Base):
     """Represents the 'admins' table in the database."""
     __tablename__ = 'admins'
@@ -47,3 +190,48 @@ class Admin(Base):
         """Returns a string representation of the Admin object."""
         return "[{}] ({}) {}".format(
             self.__tablename__, self.id, self.__dict__)
+
+
+class CheckIn(Base):
+    """Represents the append-only 'checkins' table in the database.
+
+    Rows are clustered by (user_id, ts), so one member's history is a
+    primary key range scan. The (ts, user_id) index serves per-day and
+    per-month scans; it also carries the primary key, so counting visits
+    never reads the table itself."""
+    __tablename__ = 'checkins'
+    __table_args__ = (
+        Index('ix_checkins_ts_user_id', 'ts', 'user_id'),
+        {'sqlite_with_rowid': False},
+    )
+
+    user_id = Column(Integer, primary_key=True)
+    ts = Column(DateTime, primary_key=True)
+    device_id = Column(String(50))
+
+    def __repr__(self):
+        """Returns a string representation of the CheckIn object."""
+        return "[{}] ({}) {}".format(
+            self.__tablename__, self.user_id, self.__dict__)
+
+
+class AttendanceRollup(Base):
+    """Represents the 'attendance_rollups' table in the database.
+
+    Holds the number of check-ins per day and hour for each membership
+    type and gender. It is kept up to date in the same transaction as
+    every check-in, so attendance reports read a few rows per day
+    instead of aggregating the raw checkins table."""
+    __tablename__ = 'attendance_rollups'
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    day = Column(Date, primary_key=True)
+    hour = Column(Integer, primary_key=True)
+    membership_type = Column(String(50), primary_key=True)
+    gender = Column(String(10), primary_key=True)
+    visits = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        """Returns a string representation of the AttendanceRollup object."""
+        return "[{}] ({}) {}".format(
+            self.__tablename__, self.day, self.__dict__)
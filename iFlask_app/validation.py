@@ -0,0 +1,78 @@
+"""This module contains the rules member details must follow.
+
+They are shared by the enrollment form and the roster importer, and
+kept free of database and GUI imports so the importer can run them in
+worker processes.
+"""
+
+import re
+import phonenumbers
+
+# Placeholders shown by empty entry fields and option menus
+DEFAULT_FIELDS = ['First Name', 'Last Name',
+                  'Email', 'Country Code', 'Phone Number',
+                  'Select Gender', 'Membership Type']
+# Assuming a 10-digit phone number format
+PHONE_PATTERN = re.compile(r"^[0-9]{10}$")
+# Valid characters for first_name and last_name
+NAME_PATTERN = re.compile(r"^[A-Za-z\s]+$")
+EMAIL_PATTERN = re.compile(
+    r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$")
+# Maximum length of the name and email fields
+MAX_LENGTH = 50
+# Choices of the option menus
+GENDERS = ('Male', 'Female')
+MEMBERSHIP_TYPES = ('Member', 'Not Member')
+
+
+def validate_user_fields(**kwargs):
+    """Validate the details of a member, without looking for duplicates
+    in the database. Returns an error message, or None if they are
+    valid."""
+    # Check if all required fields doesn't match the default fields
+    for field in kwargs.values():
+        if field in DEFAULT_FIELDS:
+            return "Please fill in all the required fields."
+
+    # Check the country code and phone number is valid
+    country_code = kwargs['country_code']
+    phone_number = kwargs['phone_number']
+
+    try:
+        # Format the phone number to international format
+        formatted_number = f"+{country_code.lstrip('+')}{phone_number}"
+        parsed_number = phonenumbers.parse(formatted_number, None)
+
+        if not phonenumbers.is_valid_number(parsed_number):
+            return "Invalid phone number."
+
+        # Check if the parsed number belongs to the selected country code
+        if parsed_number.country_code != int(country_code.lstrip('+')):
+            return "Phone number does not match the selected country code."
+
+    except phonenumbers.phonenumberutil.NumberParseException:
+        return "Invalid phone number format."
+
+    if not PHONE_PATTERN.match(phone_number):
+        return "Invalid phone number format."
+
+    if not NAME_PATTERN.match(kwargs['first_name']) or \
+            not NAME_PATTERN.match(kwargs['last_name']):
+        return "Invalid characters in the name fields."
+
+    if not EMAIL_PATTERN.match(kwargs['email']):
+        return "Invalid email format."
+
+    if len(kwargs['first_name']) > MAX_LENGTH or \
+            len(kwargs['last_name']) > MAX_LENGTH:
+        return "Name fields exceed the maximum length."
+    if len(kwargs['email']) > MAX_LENGTH:
+        return "Email field exceeds the maximum length."
+
+    # The option menus only offer valid choices; imported rows may not
+    if kwargs['gender'] not in GENDERS:
+        return "Invalid gender."
+    if kwargs['membership_type'] not in MEMBERSHIP_TYPES:
+        return "Invalid membership type."
+
+    return None
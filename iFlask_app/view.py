@@ -8,12 +8,20 @@ import phonenumbers
 from tkinter import messagebox, filedialog
 from typing import Callable
 import webbrowser
-import xlsxwriter
+import queue
 import subprocess
 import psutil
 
 import customtkinter as ctk
 from settings.configuration import Configuration
+from iFlask_app.virtual_list import VirtualList
+
+# Pause in typing before a live search runs
+SEARCH_DEBOUNCE_MS = 250
+# How often callbacks queued by worker threads are run on the Tk loop
+UI_QUEUE_INTERVAL_MS = 50
+# Rows scrolled per mouse wheel notch
+WHEEL_SCROLL_ROWS = 3
 
 
 class View(ctk.CTk):
@@ -37,9 +45,46 @@ class View(ctk.CTk):
         self.selected_option = tk.StringVar()
         self.selected_option.set("Admin")
 
+        # Callbacks handed over by worker threads, run on the Tk loop
+        self.ui_queue = queue.Queue()
+        self.after(UI_QUEUE_INTERVAL_MS, self.process_ui_queue)
+
+        # Live search state
+        self.search_after_id = None
+        self.search_future = None
+        self.search_generation = 0
+        # Text of the last live search scheduled
+        self.live_search_text = ''
+        self.showing_search_results = False
+
+        # Treeview selection, tracked by user id since rows scrolled out
+        # of view are removed from the treeview
+        self.selected_user_id = None
+        self.pending_render_selects = 0
+        # Users whose enrollment on the device is still queued
+        self.pending_user_ids = set()
+
         self.create_user_interface()
         self.apply_theme()
 
+    def call_soon(self, callback, *args):
+        """Run callback(*args) on the Tk main loop.
+
+        Tk widgets may only be touched from the main thread, so worker
+        threads hand their results over through this method."""
+        self.ui_queue.put((callback, args))
+
+    def process_ui_queue(self):
+        """Run the callbacks queued by worker threads."""
+        # Rescheduled first, so a failing callback cannot stop the loop
+        self.after(UI_QUEUE_INTERVAL_MS, self.process_ui_queue)
+        while True:
+            try:
+                callback, args = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            callback(*args)
+
     def create_user_interface(self):
         """Create the entire user interface"""
         self.create_menu_bar()
@@ -66,6 +111,11 @@ class View(ctk.CTk):
         self.file_menu = tk.Menu(self.menu_bar, tearoff=0)
         self.menu_bar.add_cascade(label="File", menu=self.file_menu)
         self.file_menu.add_command(label="Save", command=self.save_file)
+        self.file_menu.add_command(
+            label="Save Changes Since Last Report",
+            command=self.save_changes_file)
+        self.file_menu.add_command(
+            label="Import Members...", command=self.import_file)
         self.file_menu.add_separator()
         self.file_menu.add_command(label="Exit", command=self.exit)
 
@@ -140,17 +190,70 @@ class View(ctk.CTk):
         ttk.Separator(self.left_frame).grid(
             row=8, column=0, padx=10, pady=15, sticky='ew')
         self.create_buttons()
+        self.create_progress_widgets()
 
     def create_search_entry(self):
         """Create the search entry"""
         self.search_entry = ctk.CTkEntry(
             master=self.header_frame,
-            placeholder_text='First Name or Last Name',
+            placeholder_text='Name, Email or Phone',
             width=200)
         self.search_entry.grid(
             row=0, column=1, padx=10, pady=10, sticky='e')
         self.search_entry.bind(
             '<Return>', lambda args: self.search_user())
+        self.search_entry.bind('<KeyRelease>', self.on_search_key)
+
+    def on_search_key(self, event):
+        """Schedule a live search once the operator pauses typing, if
+        the key changed the text"""
+        if event.keysym == 'Return':
+            return
+        text = self.search_entry.get().strip()
+        if text == self.live_search_text:
+            return
+        self.live_search_text = text
+        if self.search_after_id is not None:
+            self.after_cancel(self.search_after_id)
+        self.search_after_id = self.after(
+            SEARCH_DEBOUNCE_MS, self.run_live_search)
+
+    def cancel_live_search(self):
+        """Cancel the scheduled live search and drop the results of the
+        one in progress"""
+        if self.search_after_id is not None:
+            self.after_cancel(self.search_after_id)
+            self.search_after_id = None
+        if self.search_future is not None:
+            self.search_future.cancel()
+            self.search_future = None
+        self.search_generation += 1
+
+    def run_live_search(self):
+        """Search for the text in the search entry on a worker thread.
+
+        A search that has not started yet is cancelled by the next one,
+        and results of a search that has been superseded are dropped."""
+        self.search_after_id = None
+        self.cancel_live_search()
+        generation = self.search_generation
+
+        query = self.search_entry.get().strip()
+        if not query:
+            if self.showing_search_results:
+                self.showing_search_results = False
+                self.refresh_treeview()
+            return
+        self.search_future = self.controller.search_users_in_background(
+            query, lambda users: self.show_live_results(generation, users))
+
+    def show_live_results(self, generation, users):
+        """Show the first page of a live search in the treeview"""
+        if generation != self.search_generation:
+            return
+        self.search_future = None
+        self.showing_search_results = True
+        self.show_users(users)
 
     def create_search_option_menu(self):
         """Create the search option menu"""
@@ -268,6 +371,49 @@ class View(ctk.CTk):
         self.generate_report_button.grid(
             row=14, column=0, padx=(35, 35), pady=5, sticky='ew')
 
+    def create_progress_widgets(self):
+        """Create the progress indicator shown while the controller
+        waits for the API, hidden until then"""
+        self.progress_frame = ctk.CTkFrame(
+            master=self.left_frame, fg_color='transparent')
+        self.progress_frame.grid(
+            row=15, column=0, padx=(35, 35), pady=(10, 5), sticky='ew')
+        self.progress_frame.grid_columnconfigure(0, weight=1)
+
+        self.progress_label = ctk.CTkLabel(
+            master=self.progress_frame, text='')
+        self.progress_label.grid(row=0, column=0, sticky='ew')
+
+        self.progress_bar = ctk.CTkProgressBar(
+            master=self.progress_frame, mode='indeterminate')
+        self.progress_bar.grid(row=1, column=0, pady=5, sticky='ew')
+
+        self.progress_cancel_button = ctk.CTkButton(
+            master=self.progress_frame, text='Cancel')
+        self.progress_cancel_button.grid(row=2, column=0, sticky='ew')
+        self.progress_frame.grid_remove()
+
+    def show_progress(self, text, on_cancel):
+        """Show the progress indicator; on_cancel runs when the
+        operation is cancelled"""
+        self.progress_label.configure(text=text)
+        self.progress_cancel_button.configure(command=on_cancel)
+        self.progress_bar.configure(mode='indeterminate')
+        self.progress_frame.grid()
+        self.progress_bar.start()
+
+    def set_progress(self, fraction):
+        """Show how much of the operation is done, from 0 to 1"""
+        if self.progress_bar.cget('mode') != 'determinate':
+            self.progress_bar.stop()
+            self.progress_bar.configure(mode='determinate')
+        self.progress_bar.set(fraction)
+
+    def hide_progress(self):
+        """Hide the progress indicator"""
+        self.progress_bar.stop()
+        self.progress_frame.grid_remove()
+
     def create_treeview_frame(self):
         """Create the treeview frame with vertical and
         horizontal scrollbars"""
@@ -293,15 +439,29 @@ class View(ctk.CTk):
             'Remaining Days'
         ]
 
+        # The treeview only holds the rows in view; the vertical
+        # scrollbar scrolls the virtual list of all rows instead.
         self.treeview = ttk.Treeview(
             self.treeview_frame, columns=self.column_names, show='headings',
-            yscrollcommand=self.vertical_scrollbar.set,
             xscrollcommand=self.horizontal_scrollbar.set, height=20
         )
         self.treeview.pack(fill='both', expand=True, padx=10, pady=10)
+        self.rows = VirtualList(self.fetch_treeview_rows)
+        # Treeview item id -> (values, tags) as currently shown
+        self.rendered_rows = {}
 
-        self.vertical_scrollbar.configure(command=self.treeview.yview)
+        self.vertical_scrollbar.configure(command=self.on_vertical_scroll)
         self.horizontal_scrollbar.configure(command=self.treeview.xview)
+        self.treeview.bind('<Configure>', self.on_treeview_resize)
+        self.treeview.bind('<MouseWheel>', lambda event: self.scroll_rows(
+            -event.delta // 120 * WHEEL_SCROLL_ROWS))
+        self.treeview.bind('<Button-4>', lambda event: self.scroll_rows(
+            -WHEEL_SCROLL_ROWS))
+        self.treeview.bind('<Button-5>', lambda event: self.scroll_rows(
+            WHEEL_SCROLL_ROWS))
+        self.treeview.bind('<Up>', lambda event: self.on_treeview_key(-1))
+        self.treeview.bind('<Down>', lambda event: self.on_treeview_key(1))
+        self.configure_treeview()
 
         # Configure treeview column names and widths
         column_widths = [10, 50, 50, 150, 60, 80, 20, 50, 90, 70, 90]
@@ -313,94 +473,131 @@ class View(ctk.CTk):
         # Bind Treeview selection event to on_select method
         self.treeview.bind('<<TreeviewSelect>>', lambda args: self.on_select())
 
-    def generate_report(self, all_users):
-        """Generate a report based on the provided user data."""
-        if not all_users:
-            messagebox.showerror(
-                title="Error", message="You Have Empty Database")
-            return
-
-        # Get the file path from the user using file dialog
-        file_path = filedialog.asksaveasfilename(
+    def fetch_treeview_rows(self, user_ids):
+        """Load the treeview values of a page of users"""
+        return {user.id: self.treeview_values(user)
+                for user in self.controller.get_users_by_ids(user_ids)}
+
+    def render_treeview(self):
+        """Show the rows of the virtual list that are in view.
+
+        Treeview items are keyed by user id, and only the items whose
+        row, position or zebra stripe differs from what is on screen are
+        touched, so selection and focus of the other rows are kept."""
+        window = self.rows.window()
+        wanted = {str(user_id) for _, user_id, _ in window}
+        stale = [item for item in self.treeview.get_children()
+                 if item not in wanted]
+        if stale:
+            self.treeview.delete(*stale)
+            for item in stale:
+                self.rendered_rows.pop(item, None)
+
+        for position, (index, user_id, values) in enumerate(window):
+            item = str(user_id)
+            tags = ('even',) if index % 2 == 0 else ('odd',)
+            if user_id in self.pending_user_ids:
+                tags += ('pending',)
+            shown = self.rendered_rows.get(item)
+            if shown is None:
+                self.treeview.insert(
+                    '', position, iid=item, values=values, tags=tags)
+                if user_id == self.selected_user_id:
+                    # Selecting queues a <<TreeviewSelect>> that on_select
+                    # must not treat as a new selection
+                    self.pending_render_selects += 1
+                    self.treeview.selection_set(item)
+                    self.treeview.focus(item)
+            else:
+                if self.treeview.index(item) != position:
+                    self.treeview.move(item, '', position)
+                if shown[0] != values:
+                    self.treeview.item(item, values=values)
+                if shown[1] != tags:
+                    self.treeview.item(item, tags=tags)
+            self.rendered_rows[item] = (values, tags)
+        self.vertical_scrollbar.set(*self.rows.fractions())
+
+    def on_vertical_scroll(self, action, amount, unit=None):
+        """Scroll the virtual list from the vertical scrollbar"""
+        if action == 'moveto':
+            self.rows.scroll_to(amount)
+        elif unit == 'pages':
+            self.rows.scroll_by(int(amount) * self.rows.visible)
+        else:
+            self.rows.scroll_by(int(amount))
+        self.render_treeview()
+
+    def scroll_rows(self, rows):
+        """Scroll the virtual list by a number of rows"""
+        self.rows.scroll_by(rows)
+        self.render_treeview()
+        return 'break'
+
+    def on_treeview_key(self, step):
+        """Scroll the virtual list when the arrow keys move the
+        selection past the first or last row in view"""
+        items = self.treeview.get_children()
+        focus = self.treeview.focus()
+        if not items or focus != items[0 if step < 0 else -1]:
+            return None
+        index = self.rows.row_ids.index(
+            self.treeview.item(focus)['values'][0]) + step
+        if not 0 <= index < len(self.rows):
+            return 'break'
+        user_id = self.rows.row_ids[index]
+        self.rows.scroll_into_view(user_id)
+        self.render_treeview()
+        # Selecting the row runs on_select like a click would
+        self.treeview.selection_set(str(user_id))
+        self.treeview.focus(str(user_id))
+        return 'break'
+
+    def on_treeview_resize(self, event):
+        """Fit the number of rendered rows to the treeview height"""
+        style = ttk.Style()
+        row_height = int(style.lookup('Treeview', 'rowheight') or 20)
+        # Leave room for the heading row
+        visible = max(1, event.height // row_height - 1)
+        if visible != self.rows.visible:
+            self.rows.set_visible(visible)
+            self.render_treeview()
+
+    def ask_report_path(self, formats):
+        """Ask where to save the report, offering the given
+        (description, extension) formats; returns '' if cancelled"""
+        return filedialog.asksaveasfilename(
             defaultextension=".xlsx",
-            filetypes=(("xlsx files", "*.xlsx"),
-                       ("all files", "*.*"))
+            filetypes=[(description, f"*{extension}")
+                       for description, extension in formats]
         )
 
-        try:
-            # Create workbook
-            workbook = xlsxwriter.Workbook(file_path)
-
-            # Create worksheet
-            worksheet = workbook.add_worksheet()
-
-            # Create header format
-            header_format = workbook.add_format({
-                'bold': True,
-                'font_color': 'white',
-                'bg_color': '#1E90FF',
-                'border': 1
-            })
-
-            # Create data format
-            data_format = workbook.add_format({'border': 1})
-
-            # Header row
-            headers = ['User ID', 'First Name', 'Last Name',
-                       'Email', 'Country Code', 'Phone Number',
-                       'Gender', 'Last Check In', 'Membership Type',
-                       'Next Payment', 'Start Date', 'Updated Date',
-                       'Remaining Days'
-                       ]
-
-            # Write header
-            worksheet.write_row('A1', headers, header_format)
-
-            # Set column widths manually
-            column_widths = [10, 15, 15, 35, 12,
-                             15, 10, 15, 15, 15, 12, 12, 15]
-            for col, width in enumerate(column_widths):
-                worksheet.set_column(col, col, width)
-
-            # Write data
-            for index, user in enumerate(all_users, start=1):
-                worksheet.write_row(index, 0, [
-                    user.id,
-                    user.first_name,
-                    user.last_name,
-                    user.email,
-                    '+' + str(user.country_code),
-                    user.phone_number,
-                    user.gender,
-                    str(user.last_check_in).split()[
-                        0] if user.last_check_in else '',
-                    user.membership_type,
-                    str(user.next_payment).split()[
-                        0] if user.next_payment else '',
-                    str(user.created_at).split()[0] if user.created_at else '',
-                    str(user.updated_at).split()[0] if user.updated_at else '',
-                    str(user.remaining_days).split()[
-                        0] if user.remaining_days else '',
-                ], data_format)
-
-            workbook.close()
-
-            # Display success message
-            messagebox.showinfo("Message", "Report Generated")
-        except xlsxwriter.exceptions.FileCreateError:
-            # messagebox.showerror("Error", "Please enter a valid file path")
-            pass
+    def ask_import_path(self, formats):
+        """Ask for a roster to import, offering the given
+        (description, extension) formats; returns '' if cancelled"""
+        return filedialog.askopenfilename(
+            filetypes=[(description, f"*{extension}")
+                       for description, extension in formats]
+        )
 
     def save_file(self):
         """Save the report file."""
-        all_users = self.controller.get_all_users()
-        self.generate_report(all_users)
+        self.controller.generate_report()
+
+    def save_changes_file(self):
+        """Save a report of the users changed since the last report."""
+        self.controller.generate_report(incremental=True)
+
+    def import_file(self):
+        """Import members from a roster file."""
+        self.controller.import_users()
 
     def exit(self):
         """Exit the application."""
         result = messagebox.askquestion(
             "Exit", "Are you sure you want to exit?")
         if result == "yes":
+            self.controller.shutdown()
             self.destroy()
 
     def change_theme(self, theme):
@@ -551,42 +748,46 @@ class View(ctk.CTk):
 
     def search_user(self):
         """Search for users based on the selected option"""
-        search_query = self.search_entry.get().strip().title()
+        # A live search finishing later must not replace these results
+        self.cancel_live_search()
+        search_query = self.search_entry.get().strip()
         option = self.search_option_menu.get()
-        all_users = self.controller.get_all_users()
-        filtered_users = []
 
         if option == 'Search User':
-            for user in all_users:
-                if user.first_name == search_query\
-                        or user.last_name == search_query:
-                    filtered_users.append(user)
+            filtered_users = self.controller.search_users(search_query)
 
             if not filtered_users:
                 self.display_message("No matching users found")
                 return
 
-            self.treeview.delete(*self.treeview.get_children())
-            for user in filtered_users:
-                self.add_user_to_treeview(user, update=False)
-            self.configure_treeview()
+            self.show_users(filtered_users)
 
         elif option == 'Refresh':
-            self.treeview.delete(*self.treeview.get_children())
             self.refresh_treeview()
+            self.showing_search_results = False
 
         self.search_option_menu.set("Search User")
         self.search_entry.delete(0, 'end')
-        self.search_entry.configure(placeholder_text='First Name or Last Name')
+        self.live_search_text = ''
+        self.search_entry.configure(placeholder_text='Name, Email or Phone')
 
     def on_select(self):
         """Populate entry fields with the selected user's information"""
+        if self.pending_render_selects:
+            # Selection restored by render_treeview, not by the operator
+            self.pending_render_selects -= 1
+            return
         selected_row = self.treeview.focus()
+        if selected_row == '' and self.selected_user_id in self.rows.cache:
+            # The selected row was only scrolled out of view
+            return
         values = self.treeview.item(selected_row)['values']
         self.clear_entry_fields()
 
         if selected_row == '':
+            self.selected_user_id = None
             return
+        self.selected_user_id = values[0]
         self.first_name_entry.insert(0, values[1])
         self.last_name_entry.insert(0, values[2])
         self.email_entry.insert(0, values[3])
@@ -608,8 +809,8 @@ class View(ctk.CTk):
         user_info['remaining_days'] = 30
         return user_info
 
-    def add_user_to_treeview(self, new_user, update=False):
-        """Add a user to the treeview"""
+    def treeview_values(self, new_user):
+        """Return the treeview column values for a user"""
         treeview_column = {
             'User ID': new_user.id,
             'First Name': new_user.first_name,
@@ -623,43 +824,36 @@ class View(ctk.CTk):
             'Next Payment': str(new_user.next_payment).split()[0],
             'Remaining Days': new_user.remaining_days
         }
+        return list(treeview_column.values())
 
+    def add_user_to_treeview(self, new_user, update=False):
+        """Add a user to the treeview, or update the user's row"""
+        values = self.treeview_values(new_user)
         if not update:
-            self.treeview.insert(
-                '', 'end', values=list(treeview_column.values()))
+            self.rows.append(new_user.id, values, new_user.updated_at)
         else:
-            self.treeview.item(self.treeview.focus(),
-                               values=list(treeview_column.values()))
+            self.rows.update(new_user.id, values, new_user.updated_at)
+        self.render_treeview()
 
-    def delete_user_from_treeview(self):
-        """Delete the selected user from the treeview"""
-        selected_row = self.treeview.focus()
-        self.treeview.delete(selected_row)
-        for index, row in enumerate(self.treeview.get_children()):
-            if index % 2 == 0:
-                self.treeview.item(row, tags=('even',))
-            else:
-                self.treeview.item(row, tags=('odd',))
+    def show_users(self, users):
+        """Show the given users in the treeview"""
+        self.rows.set_rows(
+            [user.id for user in users],
+            {user.id: self.treeview_values(user) for user in users})
+        self.render_treeview()
 
     def get_selected_user(self):
         """Get the selected user from the treeview"""
-        selected_row = self.treeview.focus()
-        if selected_row == '':
+        if self.selected_user_id is None:
             return None
-        values = self.treeview.item(selected_row)['values']
-        user_id = values[0]
-        user = self.controller.get_user_by_id(user_id)
+        user = self.controller.get_user_by_id(self.selected_user_id)
         return user
 
     def configure_treeview(self):
         """Configure the treeview with alternating row colors"""
         self.treeview.tag_configure('odd', background='#E8E8E8')
         self.treeview.tag_configure('even', background='lightblue')
-        for index, row in enumerate(self.treeview.get_children()):
-            if index % 2 == 0:
-                self.treeview.item(row, tags=('even',))
-            else:
-                self.treeview.item(row, tags=('odd',))
+        self.treeview.tag_configure('pending', foreground='gray')
 
     def display_message(self, message, user_id=None):
         """Display a message in a messagebox"""
@@ -668,15 +862,41 @@ class View(ctk.CTk):
         else:
             messagebox.showerror("Error", message, parent=self)
 
+    def display_info(self, message):
+        """Display an informational message in a messagebox"""
+        messagebox.showinfo("Message", message, parent=self)
+
     def refresh_treeview(self):
-        """Refresh the treeview with all users"""
-        self.treeview.delete(*self.treeview.get_children())
-        users = self.controller.get_all_users()
-        if not users:
-            return
-        for user in users:
-            self.add_user_to_treeview(user)
-        self.configure_treeview()
+        """Refresh the treeview with all users.
+
+        Only rows inserted, updated or deleted since the last refresh
+        are reloaded; the scroll position and selection are kept."""
+        self.rows.apply_versions(self.controller.get_user_versions())
+        if self.selected_user_id not in self.rows.versions:
+            self.selected_user_id = None
+        self.render_treeview()
+
+    def apply_user_changes(self, users, deleted_ids):
+        """Apply users changed or deleted elsewhere to the treeview.
+
+        Only the rows whose version differs from the one shown are
+        reloaded, so a sync that finds nothing new redraws nothing."""
+        changed = {user.id: (user.updated_at, self.treeview_values(user))
+                   for user in users}
+        # An id that is in users again was reused after its deletion
+        deleted_ids = [user_id for user_id in deleted_ids
+                       if user_id not in changed]
+        if self.selected_user_id in deleted_ids:
+            self.selected_user_id = None
+            self.clear_entry_fields()
+        if self.rows.apply_changes(changed, deleted_ids):
+            self.render_treeview()
+
+    def set_pending_users(self, user_ids):
+        """Grey out the rows of users whose enrollment is queued"""
+        if user_ids != self.pending_user_ids:
+            self.pending_user_ids = set(user_ids)
+            self.render_treeview()
 
     def bind_enroll_user_task(
             self, callback: Callable[[tk.Event], None]) -> None:
@@ -700,7 +920,7 @@ class View(ctk.CTk):
 
     def update_user_treeview(self, user_id):
         """Update the user information in the treeview."""
-        user = self.controller.get_user_by_id(user_id)
+        user, = self.controller.get_users_by_ids([user_id])
         self.add_user_to_treeview(user, update=True)
 
     def on_admin_option_changed(self, *args):
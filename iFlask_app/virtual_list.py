@@ -0,0 +1,211 @@
+"""This module contains the VirtualList class."""
+
+from collections import OrderedDict
+import bisect
+
+
+class VirtualList:
+    """The row model behind the virtualized members treeview.
+
+    It keeps the ordered ids of every row, but the values of only the
+    rows that were recently on screen. Values of rows scrolled into view
+    are fetched a page at a time through fetch_rows(ids), which returns
+    a dict mapping ids to row values. The treeview then only has to hold
+    the visible rows, however many members there are.
+
+    When the list holds all members it also keeps a version (the
+    updated_at) of every row, so a refresh can tell which rows were
+    inserted, updated or deleted and only drop those from the cache.
+    """
+
+    def __init__(self, fetch_rows, visible=20, cache_size=2000) -> None:
+        """Initialize the VirtualList class."""
+        self.fetch_rows = fetch_rows
+        self.visible = visible
+        self.cache_size = cache_size
+        self.row_ids = []
+        self.cache = OrderedDict()
+        self.first = 0
+        # id -> version of every row, or None for a list that is not a
+        # snapshot of all members, such as search results
+        self.versions = None
+
+    def __len__(self):
+        """Return the number of rows."""
+        return len(self.row_ids)
+
+    def set_rows(self, row_ids, values=None):
+        """Replace all rows and scroll back to the top.
+
+        values optionally maps ids to row values that are already known,
+        which saves fetching them again."""
+        self.row_ids = list(row_ids)
+        self.first = 0
+        self.versions = None
+        self.cache.clear()
+        self.store(values or {})
+
+    def apply_versions(self, versions):
+        """Bring the list up to date with an id ordered snapshot of
+        (id, version) pairs for all rows.
+
+        Cached values of unchanged rows are kept, and the row at the top
+        of the viewport stays there if it still exists. Returns the sets
+        of inserted, updated and deleted ids."""
+        new_versions = dict(versions)
+        old_versions = self.versions
+        if old_versions is None:
+            old_versions = {}
+            self.cache.clear()
+        inserted = new_versions.keys() - old_versions.keys()
+        deleted = old_versions.keys() - new_versions.keys()
+        kept = new_versions.keys() & old_versions.keys()
+        updated = {row_id for row_id in kept
+                   if new_versions[row_id] != old_versions[row_id]}
+        for row_id in updated | deleted:
+            self.cache.pop(row_id, None)
+
+        top = self.row_ids[self.first] if self.first < len(self.row_ids) \
+            else None
+        self.row_ids = [row_id for row_id, _ in versions]
+        self.versions = new_versions
+        if top in new_versions:
+            self.first = self.clamp(self.row_ids.index(top))
+        else:
+            self.first = self.clamp(self.first)
+        return inserted, updated, deleted
+
+    def apply_changes(self, changed, deleted):
+        """Apply the rows changed and deleted since the last sync.
+
+        changed maps ids to (version, values) and deleted is a list of
+        ids. New rows are inserted in id order, but only into a list of
+        all members; search results only pick up changes to the rows
+        they already hold. The row at the top of the viewport stays
+        there if it still exists. Returns True if anything changed."""
+        top = self.row_ids[self.first] if self.first < len(self.row_ids) \
+            else None
+        gone = set(deleted).intersection(self.row_ids)
+        if gone:
+            self.row_ids = [row_id for row_id in self.row_ids
+                            if row_id not in gone]
+            for row_id in gone:
+                self.cache.pop(row_id, None)
+                if self.versions is not None:
+                    self.versions.pop(row_id, None)
+
+        is_changed = bool(gone)
+        for row_id, (version, values) in changed.items():
+            if self.versions is None:
+                if row_id in self.cache or row_id in self.row_ids:
+                    self.store({row_id: values})
+                    is_changed = True
+                continue
+            if row_id not in self.versions:
+                bisect.insort(self.row_ids, row_id)
+            elif self.versions[row_id] == version:
+                continue
+            self.versions[row_id] = version
+            self.store({row_id: values})
+            is_changed = True
+
+        if is_changed:
+            if top is not None and top not in gone:
+                self.first = self.clamp(self.row_ids.index(top))
+            else:
+                self.first = self.clamp(self.first)
+        return is_changed
+
+    def set_visible(self, visible):
+        """Set how many rows fit in the viewport."""
+        self.visible = max(1, visible)
+        self.first = self.clamp(self.first)
+
+    def window(self):
+        """Return (index, id, values) for the rows in the viewport.
+
+        Values missing from the cache are fetched in one call, together
+        with those of the pages just above and below the viewport."""
+        ids = self.row_ids[self.first:self.first + self.visible]
+        if any(row_id not in self.cache for row_id in ids):
+            start = max(0, self.first - self.visible)
+            page = self.row_ids[start:self.first + 2 * self.visible]
+            missing = [row_id for row_id in page if row_id not in self.cache]
+            fetched = self.fetch_rows(missing)
+            self.store(fetched)
+            gone = set(missing).difference(fetched)
+            if gone:
+                # Rows deleted from the database since the ids were read
+                self.row_ids = [row_id for row_id in self.row_ids
+                                if row_id not in gone]
+                for row_id in gone:
+                    if self.versions is not None:
+                        self.versions.pop(row_id, None)
+                self.first = self.clamp(self.first)
+                ids = self.row_ids[self.first:self.first + self.visible]
+
+        rows = []
+        for index, row_id in enumerate(ids, start=self.first):
+            values = self.cache.get(row_id)
+            if values is not None:
+                self.cache.move_to_end(row_id)
+                rows.append((index, row_id, values))
+        return rows
+
+    def store(self, values):
+        """Cache row values, dropping the least recently shown rows
+        once the cache is full."""
+        self.cache.update(values)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def clamp(self, first):
+        """Keep the first visible row within the list."""
+        return max(0, min(first, len(self.row_ids) - self.visible))
+
+    def scroll_to(self, fraction):
+        """Scroll so the row at fraction of the list is at the top."""
+        self.first = self.clamp(round(float(fraction) * len(self.row_ids)))
+
+    def scroll_by(self, rows):
+        """Scroll by a number of rows, negative to scroll up."""
+        self.first = self.clamp(self.first + rows)
+
+    def scroll_into_view(self, row_id):
+        """Scroll just far enough to make a row visible."""
+        index = self.row_ids.index(row_id)
+        if index < self.first:
+            self.first = index
+        elif index >= self.first + self.visible:
+            self.first = self.clamp(index - self.visible + 1)
+
+    def fractions(self):
+        """Return the visible part of the list as scrollbar fractions."""
+        total = len(self.row_ids)
+        if total == 0:
+            return 0.0, 1.0
+        return self.first / total, min(1.0,
+                                       (self.first + self.visible) / total)
+
+    def append(self, row_id, values, version=None):
+        """Add a row at the end of the list."""
+        self.row_ids.append(row_id)
+        self.store({row_id: values})
+        if self.versions is not None:
+            self.versions[row_id] = version
+
+    def update(self, row_id, values, version=None):
+        """Replace the values of a row."""
+        if row_id in self.cache or row_id in self.row_ids:
+            self.store({row_id: values})
+            if self.versions is not None:
+                self.versions[row_id] = version
+
+    def remove(self, row_id):
+        """Remove a row from the list."""
+        if row_id in self.row_ids:
+            self.row_ids.remove(row_id)
+        self.cache.pop(row_id, None)
+        if self.versions is not None:
+            self.versions.pop(row_id, None)
+        self.first = self.clamp(self.first)
@@ -10,6 +10,8 @@ def main() -> None:
     controller.reload()
     controller.view.connect_to_esp32()
     controller.run()
+    # Also reached when the window is closed without the Exit menu
+    controller.shutdown()
     controller.view.disconnect_from_esp32()
     controller.reset_default_config()
 
@@ -0,0 +1,27 @@
+"""Fixtures shared by the tests."""
+
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='session')
+def api(tmp_path_factory):
+    """Import the API against an empty database in a temporary
+    directory holding a copy of the settings. Tests import the app's
+    modules after this, as the engine resolves database.db against the
+    working directory it is imported in."""
+    workdir = tmp_path_factory.mktemp('api')
+    shutil.copytree(os.path.join(ROOT, 'settings'), workdir / 'settings')
+    previous = os.getcwd()
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    try:
+        import api
+        yield api
+    finally:
+        os.chdir(previous)
@@ -0,0 +1,43 @@
+"""Tests of the GET /api/users sync endpoint."""
+
+from datetime import datetime, timedelta
+
+
+def add_user(api, phone_number, updated_at):
+    """Add a member whose last change is stamped updated_at."""
+    session = api.model.Session()
+    try:
+        user = api.model.bind(session).add_user(
+            first_name='Test', last_name='Member',
+            email=f'member{phone_number}@example.com', country_code=44,
+            phone_number=phone_number, gender='Female',
+            membership_type='Member', remaining_days=30,
+            updated_at=updated_at)
+        return user.id
+    finally:
+        session.close()
+
+
+def test_watermark_does_not_pass_changes_still_committing(api):
+    client = api.app.test_client()
+    now = datetime.utcnow()
+    add_user(api, 7400000001, now - timedelta(seconds=1))
+
+    first = client.get('/api/users').get_json()
+    watermark = datetime.fromisoformat(first['watermark'])
+    assert watermark <= datetime.utcnow() - api.COMMIT_LAG
+
+    # Stamped before the row the first poll returned, committed after it
+    late_id = add_user(api, 7400000002, now - timedelta(seconds=5))
+    second = client.get('/api/users',
+                        query_string={'since': first['watermark']}).get_json()
+    assert late_id in [user['id'] for user in second['users']]
+    assert datetime.fromisoformat(second['watermark']) >= watermark
+
+
+def test_watermark_stays_at_since_without_changes(api):
+    client = api.app.test_client()
+    since = (datetime.utcnow() + timedelta(days=1)).isoformat()
+    response = client.get('/api/users', query_string={'since': since})
+    assert response.get_json() == {'users': [], 'deleted': [],
+                                   'watermark': since}
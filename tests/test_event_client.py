@@ -0,0 +1,69 @@
+"""Tests of the EventStream that follows the API's user events."""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from iFlask_app import event_client  # noqa: E402
+from iFlask_app.event_client import EventStream  # noqa: E402
+
+
+class FakeResponse:
+    """A streamed response that yields the given lines."""
+
+    def __init__(self, lines) -> None:
+        """Initialize the FakeResponse class."""
+        self.lines = lines
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        """Accept the response."""
+
+    def iter_lines(self, decode_unicode=False):
+        """Yield the lines of the stream."""
+        yield from self.lines
+
+
+def test_bad_events_are_skipped():
+    """A malformed event, or one on_event fails on, does not end the
+    stream."""
+    received = []
+
+    def on_event(kind, data):
+        if data['user_id'] == 2:
+            raise RuntimeError("handler failed")
+        received.append((kind, data['user_id']))
+
+    stream = EventStream('http://scanner/events', on_event)
+    stream.read_events(FakeResponse([
+        'event: create', 'data: {"user_id": 1', '',
+        'event: create', 'data: {"user_id": 2}', '',
+        'event: delete', 'data: {"user_id": 3}', '',
+    ]))
+    assert received == [('delete', 3)]
+
+
+def test_connected_is_cleared_when_the_stream_fails(monkeypatch):
+    """An unexpected error while reading leaves connected False, so the
+    sync goes back to polling."""
+    stream = EventStream('http://scanner/events', None)
+
+    def on_connect():
+        assert stream.connected
+        raise RuntimeError("connect hook failed")
+
+    stream.on_connect = on_connect
+    monkeypatch.setattr(event_client.requests, 'get',
+                        lambda *args, **kwargs: FakeResponse([]))
+    with pytest.raises(RuntimeError):
+        stream.run()
+    assert not stream.connected
@@ -0,0 +1,20 @@
+"""Tests of the roster importer."""
+
+
+def test_reimports_a_phone_number_with_a_leading_zero(api, tmp_path):
+    from iFlask_app import exporters, importer
+
+    with api.model.scoped() as model:
+        user = model.add_user(
+            first_name='Giulia', last_name='Rossi',
+            email='giulia.rossi@example.com', country_code=39,
+            phone_number=int('0612345678'), gender='Female',
+            membership_type='Member', remaining_days=30)
+        rows = [row for row in model.iter_users() if row.id == user.id]
+        path = str(tmp_path / 'members.csv')
+        exporters.export(path, rows, len(rows))
+        model.delete_user(user)
+
+        result = importer.import_users(path, model, max_workers=1)
+        assert (result.imported, result.rejected) == (1, 0)
+        assert model.get_existing_phone_numbers({612345678}) == {612345678}
@@ -0,0 +1,136 @@
+"""Tests of the device operations queued in the outbox, and of the
+OutboxDispatcher sending them through the API to a fake scanner."""
+
+from datetime import datetime
+import threading
+import time
+
+import pytest
+import requests
+from werkzeug.serving import make_server as make_api_server
+
+
+def add_pending_user(model, phone_number, first_name='Pending'):
+    """Add a member whose enrollment is queued and return their id."""
+    user = model.add_pending_user(
+        first_name=first_name, last_name='Member',
+        email=f'member{phone_number}@example.com', country_code=44,
+        phone_number=phone_number, gender='Male',
+        membership_type='Member', remaining_days=30)
+    return user.id
+
+
+def queued(model, user_id):
+    """Return (operation, attempts, first_name) of the user's queued
+    operations."""
+    return [(operation.operation, operation.attempts, operation.first_name)
+            for operation in model.get_outbox_operations()
+            if operation.user_id == user_id]
+
+
+def test_deleting_a_retried_enrollment_queues_one_deletion(api):
+    with api.model.scoped() as model:
+        user_id = add_pending_user(model, 7410000001, first_name='A')
+        [enrollment] = model.get_outbox_operations()[-1:]
+        model.retry_outbox_operation(enrollment, 'API answered 503.',
+                                     datetime.utcnow())
+        # The retried enrollment is sent again while the user is deleted
+        model.queue_user_deletion(model.get_user_by_id(user_id))
+        model.finish_outbox_operation(enrollment)
+        assert queued(model, user_id) == [('delete', 0, 'A')]
+        model.finish_outbox_operation(model.get_outbox_operations()[-1])
+
+
+def test_deleting_an_unsent_enrollment_queues_nothing(api):
+    with api.model.scoped() as model:
+        user_id = add_pending_user(model, 7410000002)
+        assert queued(model, user_id) == [('enroll', 0, 'Pending')]
+        model.queue_user_deletion(model.get_user_by_id(user_id))
+        assert queued(model, user_id) == []
+
+
+@pytest.fixture
+def api_url(api):
+    """Serve the API on a free local port and return its base URL."""
+    server = make_api_server('127.0.0.1', 0, api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield f'http://127.0.0.1:{server.server_port}'
+    finally:
+        server.shutdown()
+
+
+@pytest.fixture
+def scanner(api, monkeypatch):
+    """Point the API at a fake ESP32 and return a function that starts
+    it, so tests can begin with the scanner down."""
+    from iFlask_app.device_client import DeviceClient
+    from iFlask_app.fake_esp32 import make_server
+
+    # A port that was free, on which nothing listens until started
+    probe = make_server()
+    port = probe.server_port
+    probe.server_close()
+    servers = []
+    monkeypatch.setattr(api, 'device', DeviceClient(
+        f'http://127.0.0.1:{port}', connect_timeout=0.5, read_timeout=5,
+        failure_threshold=2, reset_timeout=0.1))
+
+    def start():
+        server = make_server(port=port)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+    api.device.close()
+
+
+def make_dispatcher(api_url):
+    """Create a dispatcher that polls jobs and backs off quickly."""
+    from iFlask_app.outbox import OutboxDispatcher
+
+    return OutboxDispatcher(
+        requests.Session(), f'{api_url}/api/user', f'{api_url}/api/jobs',
+        (1, 5), job_poll_interval=0.02, retry_base=0.05, retry_max=0.05)
+
+
+def test_sends_a_queued_enrollment(api, api_url, scanner):
+    scanner()
+    with api.model.scoped() as model:
+        user_id = add_pending_user(model, 7410000003)
+        finished = make_dispatcher(api_url).run_pass(model)
+        assert finished == [('enroll', user_id, True)]
+        assert queued(model, user_id) == []
+        assert model.get_user_by_id(user_id) is not None
+
+
+def test_retries_while_the_scanner_is_down(api, api_url, scanner):
+    dispatcher = make_dispatcher(api_url)
+    with api.model.scoped() as model:
+        user_id = add_pending_user(model, 7410000004)
+        # Each unreachable attempt counts towards the breaker
+        for _ in range(2):
+            assert dispatcher.run_pass(model) == []
+            time.sleep(0.1)
+        assert api.device.is_open
+
+        # With the breaker open, the API turns enrollments away with a
+        # 503 and the enrollment stays queued for later
+        assert dispatcher.run_pass(model) == []
+        [operation] = [operation
+                       for operation in model.get_outbox_operations()
+                       if operation.user_id == user_id]
+        assert (operation.attempts, operation.last_error) == \
+            (3, 'API answered 503.')
+
+        # The breaker closes once the scanner answers its probe
+        scanner()
+        deadline = time.monotonic() + 5
+        while api.device.is_open and time.monotonic() < deadline:
+            time.sleep(0.05)
+        time.sleep(0.1)
+        assert dispatcher.run_pass(model) == [('enroll', user_id, True)]
+        assert queued(model, user_id) == []
@@ -0,0 +1,16 @@
+"""Runs the query plan check of iFlask_app.query_plans."""
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_hot_queries_do_not_scan_users():
+    # A process of its own, as the check opens the app's database in a
+    # temporary working directory
+    result = subprocess.run(
+        [sys.executable, '-m', 'iFlask_app.query_plans', '--users', '20000'],
+        cwd=ROOT, capture_output=True, text=True, timeout=600)
+    assert result.returncode == 0, result.stdout + result.stderr